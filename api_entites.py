@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 
 # Response models for API documentation
@@ -25,7 +25,20 @@ class BillData(BaseModel):
     water: float = Field(..., description="Water charges amount")
     sewage: Optional[float] = Field(None, description="Sewage charges (if applicable)")
     bill_amount: float = Field(..., description="Total bill amount")
+    page_no: Optional[int] = Field(
+        None, description="Page of the PDF the bill was extracted from"
+    )
+    problems: List[str] = Field(
+        default_factory=list,
+        description="Validation checks the bill still fails, empty when it looks right",
+    )
     image: Optional[str] = Field(None, description="Bill image in base64 format")
+    image_format: Optional[str] = Field(
+        None, description="Format of the bill image: png, jpeg or webp"
+    )
+    image_url: Optional[str] = Field(
+        None, description="URL of the bill page image when images are returned by reference"
+    )
 
     class Config:
         json_schema_extra = {
@@ -38,16 +51,75 @@ class BillData(BaseModel):
                 "water": 45.20,
                 "sewage": 12.30,
                 "bill_amount": 57.50,
-                "image":"..."
+                "page_no": 0,
+                "problems": [],
+                "image":"...",
+                "image_format": "png",
             }
         }
 
 
+class FileError(BaseModel):
+    """A file of the batch that could not be processed"""
+
+    file_name: str = Field(..., description="Original filename of the failed PDF")
+    detail: str = Field(..., description="Reason the file could not be processed")
+
+
+class PeriodIssue(BaseModel):
+    """Gap or overlap between the reading periods of consecutive bills"""
+
+    kind: Literal["gap", "overlap"] = Field(..., description="Kind of issue")
+    start: DateInfo = Field(..., description="First day of the gap or overlap")
+    end: DateInfo = Field(..., description="Last day of the gap or overlap")
+    days: int = Field(..., description="Length of the gap or overlap in days")
+    previous_file: str = Field(..., description="File of the earlier bill")
+    file_name: str = Field(..., description="File of the later bill")
+
+
+class PeriodTotal(BaseModel):
+    """Totals of the bills whose reading period ends in a month or year"""
+
+    period: str = Field(..., description="Month as YYYY-MM, or year as YYYY")
+    bills: int = Field(..., description="Number of bills")
+    usage: float = Field(..., description="Water consumption in cubic meters")
+    water: float = Field(..., description="Water charges")
+    sewage: float = Field(..., description="Sewage charges")
+    bill_amount: float = Field(..., description="Total billed amount")
+
+
+class MergedSummary(BaseModel):
+    """Account history built from the bills of every file of the batch"""
+
+    bills: int = Field(..., description="Bills left after removing duplicates")
+    duplicates: int = Field(
+        ..., description="Bills dropped as copies of the same bill number and period"
+    )
+    start: Optional[DateInfo] = Field(None, description="Earliest reading date")
+    end: Optional[DateInfo] = Field(None, description="Latest reading date")
+    issues: List[PeriodIssue] = Field(
+        default_factory=list,
+        description="Gaps and overlaps between consecutive reading periods",
+    )
+    monthly: List[PeriodTotal] = Field(
+        default_factory=list, description="Totals by month of the current reading"
+    )
+    yearly: List[PeriodTotal] = Field(
+        default_factory=list, description="Totals by year of the current reading"
+    )
+
+
 class ExtractResponse(BaseModel):
     """Response model for bill extraction"""
 
     address: str = Field(..., description="Customer address extracted from the bill")
     bills: List[BillData] = Field(..., description="List of extracted bill data")
+    errors: List[FileError] = Field(
+        default_factory=list, description="Files of the batch that failed processing"
+    )
+    merged: Optional[MergedSummary] = Field(
+        None, description="Account history summary, in merged mode only"
+    )
 
     class Config:
         json_schema_extra = {
@@ -69,6 +141,93 @@ class ExtractResponse(BaseModel):
         }
 
 
+class JobFile(BaseModel):
+    """Progress of one file of an extraction job"""
+
+    file_name: str = Field(..., description="Original filename of the PDF")
+    status: Literal["queued", "running", "done", "failed"] = Field(
+        "queued", description="Processing status of the file"
+    )
+    nodes: List[str] = Field(
+        default_factory=list, description="Workflow nodes completed so far, in order"
+    )
+    address: Optional[str] = Field(None, description="Address extracted from the file")
+    bills: List[BillData] = Field(
+        default_factory=list, description="Bills extracted from the file once done"
+    )
+    error: Optional[str] = Field(None, description="Reason the file failed")
+
+
+class JobStatus(BaseModel):
+    """Progress of an extraction job"""
+
+    job_id: str = Field(..., description="Identifier of the job")
+    status: Literal["queued", "running", "done"] = Field(
+        ..., description="Done once every file is either done or failed"
+    )
+    files: List[JobFile] = Field(..., description="Per file progress, in upload order")
+
+
+class JobCreated(BaseModel):
+    """Response of a job submission"""
+
+    job_id: str = Field(..., description="Identifier of the job")
+    status_url: str = Field(..., description="URL polled for the job progress")
+    stream_url: str = Field(..., description="URL streaming bills as files complete")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "job_id": "3f9c2b1e8a7d4c6e9b0a1f2e3d4c5b6a",
+                "status_url": "/jobs/3f9c2b1e8a7d4c6e9b0a1f2e3d4c5b6a",
+                "stream_url": "/jobs/3f9c2b1e8a7d4c6e9b0a1f2e3d4c5b6a/stream",
+            }
+        }
+
+
+class HealthResponse(BaseModel):
+    """Health endpoint response"""
+
+    status: Literal["ok"] = Field("ok", description="Service status")
+    uptime_seconds: float = Field(..., description="Seconds since the API started")
+    jobs_queued: int = Field(..., description="Files waiting in the job queue")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": "ok",
+                "uptime_seconds": 3600.5,
+                "jobs_queued": 0,
+            }
+        }
+
+
+class ReadyResponse(BaseModel):
+    """Readiness endpoint response"""
+
+    status: Literal["ready", "not_ready"] = Field(..., description="Readiness status")
+    warm: bool = Field(
+        ...,
+        description="Whether provider clients are created and the graphs compiled",
+    )
+    missing_settings: List[str] = Field(
+        default_factory=list, description="Required environment variables not set"
+    )
+    warmup_seconds: Optional[float] = Field(
+        None, description="Duration of the warm-up, once it ran"
+    )
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "status": "ready",
+                "warm": True,
+                "missing_settings": [],
+                "warmup_seconds": 1.42,
+            }
+        }
+
+
 class RootResponse(BaseModel):
     """Root endpoint response"""
 
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Callable, List, NamedTuple, Optional, Union
+
+from cassettes import CASSETTE_DIR, cassette_key
+from governor import governor
+from metrics import BATCH_DURATION, BATCH_REQUESTS
+from providers import genai_types as types, google_client
+
+logger = logging.getLogger(__name__)
+
+# A batch is submitted once BATCH_MAX_REQUESTS calls of a model are collected,
+# or BATCH_MAX_WAIT seconds after its first call, whichever comes first. Jobs
+# are then polled every BATCH_POLL_INTERVAL seconds until they finish.
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", "500"))
+BATCH_MAX_WAIT = float(os.environ.get("BATCH_MAX_WAIT", "30"))
+BATCH_POLL_INTERVAL = float(os.environ.get("BATCH_POLL_INTERVAL", "30"))
+
+# Directory of the batches of the local file backend, and seconds before it
+# answers a batch, standing in for the provider turnaround
+BATCH_DIR = os.environ.get("BATCH_DIR", ".cache/batches")
+BATCH_FILE_DELAY = float(os.environ.get("BATCH_FILE_DELAY", "0"))
+
+# Job states after which a Gemini batch job does not change anymore
+FINISHED_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_PARTIALLY_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+
+class BatchError(Exception):
+    pass
+
+
+class BatchRequest(NamedTuple):
+    contents: Any
+    config: "types.GenerateContentConfig"
+    # What identifies the call, the request of its cassette
+    request: dict
+
+
+# The response of each request of a batch, in request order, or the error it
+# failed with
+BatchResults = List[Union["types.GenerateContentResponse", Exception]]
+
+
+class BatchBackend(ABC):
+    """Where batches are submitted to and polled from"""
+
+    name: str
+
+    @abstractmethod
+    async def submit(self, model: str, requests: List[BatchRequest]) -> str:
+        """Submit the requests as one batch and return the batch id"""
+
+    @abstractmethod
+    async def poll(self, batch_id: str) -> Optional[BatchResults]:
+        """Results of the batch once finished, None while it still runs"""
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch API with inline requests. Submissions and polls go through
+    the governor, under a "batches" bucket of their own."""
+
+    name = "gemini"
+
+    async def submit(self, model: str, requests: List[BatchRequest]) -> str:
+        job = await governor.call(
+            "batches",
+            lambda: google_client().aio.batches.create(
+                model=model,
+                src=[
+                    types.InlinedRequest(
+                        contents=[types.Content(role="user", parts=[request.contents])],
+                        config=request.config,
+                    )
+                    for request in requests
+                ],
+                config=types.CreateBatchJobConfig(
+                    display_name=f"bill-parser-{uuid.uuid4().hex[:12]}"
+                ),
+            ),
+        )
+
+        return job.name
+
+    async def poll(self, batch_id: str) -> Optional[BatchResults]:
+        job = await governor.call(
+            "batches", lambda: google_client().aio.batches.get(name=batch_id)
+        )
+        state = job.state.name if job.state else "JOB_STATE_UNSPECIFIED"
+
+        if state not in FINISHED_STATES:
+            return None
+
+        if not job.dest or not job.dest.inlined_responses:
+            raise BatchError(f"Batch {batch_id} ended in {state}: {job.error}")
+
+        return [
+            BatchError(f"Batch {batch_id} request failed: {response.error}")
+            if response.error or not response.response
+            else response.response
+            for response in job.dest.inlined_responses
+        ]
+
+
+def replay_cassette(model: str, request: dict) -> dict:
+    """Answer a request of the file backend with its recorded Gemini response"""
+
+    key = cassette_key("gemini", model, request)
+
+    with open(os.path.join(CASSETTE_DIR, "gemini", f"{key}.json")) as cassette:
+        return json.load(cassette)["response"]
+
+
+class FileBatchBackend(BatchBackend):
+    """Local stand-in for a provider batch API, to run batch mode offline.
+
+    A batch is a directory of ``root`` holding ``requests.jsonl``, and it is
+    finished once ``responses.jsonl`` is written next to it, one line per
+    request with its ``response`` or ``error``. ``respond`` writes the
+    responses when the batch is polled, ``BATCH_FILE_DELAY`` seconds after it
+    was submitted. Without it the backend waits for another process to write
+    them.
+    """
+
+    name = "file"
+
+    def __init__(
+        self,
+        root: str = BATCH_DIR,
+        respond: Optional[Callable[[str, dict], dict]] = replay_cassette,
+        delay: float = BATCH_FILE_DELAY,
+    ):
+        self.root = root
+        self.respond = respond
+        self.delay = delay
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.root, batch_id, name)
+
+    def _write(self, path: str, lines: List[dict]):
+        # Written under a temporary name first, a poll never sees a partial file
+        with open(f"{path}.tmp", "w") as file:
+            file.writelines(json.dumps(line) + "\n" for line in lines)
+
+        os.replace(f"{path}.tmp", path)
+
+    def _read(self, path: str) -> List[dict]:
+        with open(path) as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def _answer(self, batch_id: str) -> bool:
+        responses_path = self._path(batch_id, "responses.jsonl")
+
+        if os.path.exists(responses_path):
+            return True
+
+        requests_path = self._path(batch_id, "requests.jsonl")
+
+        if self.respond is None or time.time() - os.path.getmtime(requests_path) < self.delay:
+            return False
+
+        responses = []
+
+        for line in self._read(requests_path):
+            try:
+                responses.append({"response": self.respond(line["model"], line["request"])})
+            except Exception as error:
+                responses.append({"error": repr(error)})
+
+        self._write(responses_path, responses)
+
+        return True
+
+    async def submit(self, model: str, requests: List[BatchRequest]) -> str:
+        batch_id = f"batch-{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(os.path.join(self.root, batch_id))
+
+        await asyncio.to_thread(
+            self._write,
+            self._path(batch_id, "requests.jsonl"),
+            [{"model": model, "request": request.request} for request in requests],
+        )
+
+        return batch_id
+
+    async def poll(self, batch_id: str) -> Optional[BatchResults]:
+        if not await asyncio.to_thread(self._answer, batch_id):
+            return None
+
+        lines = await asyncio.to_thread(self._read, self._path(batch_id, "responses.jsonl"))
+
+        return [
+            types.GenerateContentResponse.model_validate(line["response"])
+            if "response" in line
+            else BatchError(f"Batch {batch_id} request failed: {line.get('error')}")
+            for line in lines
+        ]
+
+
+BATCH_BACKENDS = {"gemini": GeminiBatchBackend, "file": FileBatchBackend}
+
+
+class Batcher:
+    """Collects the Gemini calls of many documents into batches.
+
+    Every call waits for the results of its batch, so documents run through
+    the graph as in the interactive mode, only each Gemini call of a document
+    takes the turnaround of a batch. Calls of different models go to separate
+    batches, a batch job runs a single model.
+    """
+
+    def __init__(
+        self,
+        backend: BatchBackend,
+        max_requests: int = BATCH_MAX_REQUESTS,
+        max_wait: float = BATCH_MAX_WAIT,
+        poll_interval: float = BATCH_POLL_INTERVAL,
+    ):
+        self.backend = backend
+        self.max_requests = max_requests
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.batches = 0
+        self._pending: dict[str, List[tuple]] = defaultdict(list)
+        self._timers: dict[str, asyncio.TimerHandle] = {}
+        self._jobs: set[asyncio.Task] = set()
+
+    async def generate(
+        self, model: str, request: BatchRequest
+    ) -> "types.GenerateContentResponse":
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending[model]
+        pending.append((request, future))
+
+        if len(pending) >= self.max_requests:
+            self.flush(model)
+        elif model not in self._timers:
+            self._timers[model] = asyncio.get_running_loop().call_later(
+                self.max_wait, self.flush, model
+            )
+
+        return await future
+
+    def flush(self, model: Optional[str] = None):
+        """Submit the calls collected so far, of one model or of all of them"""
+
+        for flushed in [model] if model else list(self._pending):
+            timer = self._timers.pop(flushed, None)
+
+            if timer:
+                timer.cancel()
+
+            calls = self._pending.pop(flushed, [])
+
+            if calls:
+                job = asyncio.create_task(self._run(flushed, calls))
+                self._jobs.add(job)
+                job.add_done_callback(self._jobs.discard)
+
+    async def _run(self, model: str, calls: List[tuple]):
+        started = time.perf_counter()
+        self.batches += 1
+
+        try:
+            batch_id = await self.backend.submit(model, [request for request, _ in calls])
+            logger.info("Submitted batch %s of %d %s calls", batch_id, len(calls), model)
+
+            while (results := await self.backend.poll(batch_id)) is None:
+                await asyncio.sleep(self.poll_interval)
+
+            if len(results) != len(calls):
+                raise BatchError(
+                    f"Batch {batch_id} returned {len(results)} results for {len(calls)} requests"
+                )
+        except Exception as error:
+            logger.exception("Batch of %d %s calls failed", len(calls), model)
+            results = [error] * len(calls)
+
+        BATCH_DURATION.observe(
+            time.perf_counter() - started, backend=self.backend.name, model=model
+        )
+
+        for (_, future), result in zip(calls, results):
+            failed = isinstance(result, Exception)
+            BATCH_REQUESTS.inc(
+                backend=self.backend.name, outcome="failed" if failed else "ok"
+            )
+
+            # The document waiting for it may have been cancelled meanwhile
+            if future.done():
+                continue
+
+            if failed:
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+# Set by bulk runs in batch mode. Graph nodes run in tasks copied from the
+# context of their document, so every Gemini call of the run is batched.
+active_batcher: ContextVar[Optional[Batcher]] = ContextVar("active_batcher", default=None)
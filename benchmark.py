@@ -0,0 +1,463 @@
+"""Offline benchmark of the extraction graph over tests/data.
+
+Runs every PDF through the graph at each requested concurrency and reports
+p50/p95 latency per node and per document, throughput, peak RSS, per document
+peak memory and field level accuracy against tests/expected_results.json. The result and
+page caches are bypassed. Cold start, the import time of the API and the time to its first
+response, is measured in fresh interpreters. Record the provider responses once, then replay them for free:
+
+    CASSETTE_MODE=record python benchmark.py --concurrency 1
+    CASSETTE_MODE=replay python benchmark.py --concurrency 1 4 8
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import workflow
+from workflow import arun_graph, to_bill_data
+from api_entites import BillData
+from pdf_source import PdfSource
+from rendering import shutdown_render_pool
+from stages import stages
+
+FIELDS = ["start_date", "end_date", "usage", "bill_amount"]
+
+
+def load_expected(path: str) -> dict[str, dict]:
+    """Expected results are listed in the order of tests/data/test<n>.pdf"""
+
+    with open(path) as expected:
+        results = json.load(expected)["results"]
+
+    return {f"test{index + 1}.pdf": result for index, result in enumerate(results)}
+
+
+def field_matches(bill: BillData, expected: dict) -> dict[str, bool]:
+    return {
+        "start_date": bill.start_date.model_dump() == expected["previous_date"],
+        "end_date": bill.end_date.model_dump() == expected["current_date"],
+        "usage": abs(bill.usage - expected["consumption"]) < 0.01,
+        "bill_amount": abs(bill.bill_amount - expected["current_bill"]) < 0.01,
+    }
+
+
+def score(bills: List[BillData], expected: Optional[dict]) -> Optional[dict[str, bool]]:
+    """Field matches of the bill closest to the expected one"""
+
+    if expected is None:
+        return None
+
+    if not bills:
+        return {field: False for field in FIELDS}
+
+    return max(
+        (field_matches(bill, expected) for bill in bills),
+        key=lambda matches: sum(matches.values()),
+    )
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+class RssSampler(threading.Thread):
+    """Samples the resident set size of the process every ``interval`` seconds
+    and tracks how far it grew over the lifetime of each document. Documents
+    overlap at higher concurrency, so the per document peaks are only exact
+    at concurrency 1. Render workers are separate processes and not counted.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self._documents: dict[int, List[float]] = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            rss = current_rss_mb()
+
+            with self._lock:
+                for baseline_and_peak in self._documents.values():
+                    baseline_and_peak[1] = max(baseline_and_peak[1], rss)
+
+    def start_document(self) -> int:
+        token = next(self._tokens)
+        rss = current_rss_mb()
+
+        with self._lock:
+            self._documents[token] = [rss, rss]
+
+        return token
+
+    def end_document(self, token: int) -> float:
+        """Peak growth of the RSS in MB since the document started"""
+
+        rss = current_rss_mb()
+
+        with self._lock:
+            baseline, peak = self._documents.pop(token)
+
+        return max(peak, rss) - baseline
+
+    def stop(self):
+        self._stopped.set()
+
+
+def percentiles(values: List[float]) -> dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "max": round(max(values), 3),
+    }
+
+
+async def run_document(path: str, mode: Optional[str], sampler: RssSampler) -> dict:
+    token = sampler.start_document()
+    started = time.perf_counter()
+    final_state = await arun_graph(PdfSource.from_file(path), mode=mode)
+    latency = time.perf_counter() - started
+
+    filename = os.path.basename(path)
+
+    return {
+        "file": filename,
+        "latency": latency,
+        "peak_memory_mb": sampler.end_document(token),
+        "node_timings": final_state["node_timings"],
+        "llm_calls": final_state["llm_calls"],
+        "extracted_by": final_state["extracted_by"],
+        "content_tokens": final_state["content_tokens"],
+        "bills": to_bill_data(final_state, filename),
+    }
+
+
+async def run(
+    paths: List[str], concurrency: int, mode: Optional[str], sampler: RssSampler
+) -> dict:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def bounded(path: str):
+        async with slots:
+            try:
+                return await run_document(path, mode, sampler)
+            except Exception as error:
+                return {"file": os.path.basename(path), "error": repr(error)}
+
+    before = {
+        stage.name: (stage.busy_seconds, stage.wait_seconds, stage.completed)
+        for stage in stages
+    }
+    started = time.perf_counter()
+    documents = await asyncio.gather(*(bounded(path) for path in paths))
+    wall = time.perf_counter() - started
+
+    stage_usage = {}
+    for stage in stages:
+        busy, waited, completed = before[stage.name]
+        stage_usage[stage.name] = {
+            "tasks": stage.completed - completed,
+            "utilization": round((stage.busy_seconds - busy) / (stage.capacity * wall), 3),
+            "queue_wait_seconds": round(stage.wait_seconds - waited, 3),
+        }
+
+    return {
+        "concurrency": concurrency,
+        "wall": wall,
+        "documents": documents,
+        "stages": stage_usage,
+    }
+
+
+def route_samples(documents: List[dict], expected: dict[str, dict]) -> List[dict]:
+    """Route, features, latency and accuracy of every document, to tune the
+    routing policy against. The route of a document is the one of its first
+    extraction call, "rules" when no extraction call was made."""
+
+    samples = []
+
+    for doc in documents:
+        routes = [call["route"] for call in doc["llm_calls"] if call.get("route")]
+        first = next((route for route in routes if route["reason"] != "validation"), None)
+        matches = score(doc["bills"], expected.get(doc["file"]))
+
+        samples.append(
+            {
+                "file": doc["file"],
+                "route": f"{first['model']}/thinking={first['thinking_budget']}"
+                if first
+                else "rules",
+                "reason": first["reason"] if first else None,
+                "features": first["features"] if first else {},
+                "escalated": any(route["reason"] == "validation" for route in routes),
+                "latency": round(doc["latency"], 3),
+                "accuracy": round(float(np.mean(list(matches.values()))), 3)
+                if matches
+                else None,
+            }
+        )
+
+    return samples
+
+
+def route_summary(samples: List[dict]) -> dict[str, dict]:
+    summary = {}
+
+    for route in sorted({sample["route"] for sample in samples}):
+        routed = [sample for sample in samples if sample["route"] == route]
+        scored = [sample["accuracy"] for sample in routed if sample["accuracy"] is not None]
+
+        summary[route] = {
+            "documents": len(routed),
+            "escalated": sum(sample["escalated"] for sample in routed),
+            "latency_p50": percentiles([sample["latency"] for sample in routed])["p50"],
+            "accuracy": round(float(np.mean(scored)), 3) if scored else None,
+        }
+
+    return summary
+
+
+def report(run_result: dict, expected: dict[str, dict]) -> dict:
+    documents = [doc for doc in run_result["documents"] if "error" not in doc]
+    errors = [doc for doc in run_result["documents"] if "error" in doc]
+
+    nodes = defaultdict(list)
+    for doc in documents:
+        for node, seconds in doc["node_timings"]:
+            nodes[node].append(seconds)
+
+    samples = route_samples(documents, expected)
+
+    matches = [
+        matches
+        for doc in run_result["documents"]
+        if (matches := score(doc.get("bills", []), expected.get(doc["file"])))
+        is not None
+    ]
+
+    accuracy = {
+        field: round(float(np.mean([match[field] for match in matches])), 3)
+        for field in FIELDS
+    } if matches else {}
+
+    return {
+        "concurrency": run_result["concurrency"],
+        "documents": len(run_result["documents"]),
+        "errors": [f"{doc['file']}: {doc['error']}" for doc in errors],
+        "wall_seconds": round(run_result["wall"], 3),
+        "throughput_docs_per_min": round(
+            60 * len(documents) / run_result["wall"], 2
+        ),
+        "document_latency": percentiles([doc["latency"] for doc in documents])
+        if documents
+        else {},
+        "node_latency": {node: percentiles(values) for node, values in nodes.items()},
+        "document_peak_memory_mb": percentiles(
+            [doc["peak_memory_mb"] for doc in documents]
+        )
+        if documents
+        else {},
+        "prompt_tokens": sum(
+            call["prompt_tokens"] for doc in documents for call in doc["llm_calls"]
+        ),
+        "output_tokens": sum(
+            call["output_tokens"] for doc in documents for call in doc["llm_calls"]
+        ),
+        "content_tokens": {
+            stage: sum(doc["content_tokens"].get(stage, 0) for doc in documents)
+            for stage in ("raw", "compacted")
+        },
+        "extraction_paths": dict(
+            Counter(doc["extracted_by"] for doc in documents)
+        ),
+        "stages": run_result["stages"],
+        "routes": route_summary(samples),
+        "route_samples": samples,
+        "accuracy": accuracy,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_report(result: dict):
+    print(f"\n== concurrency {result['concurrency']} ==")
+    print(
+        f"{result['documents']} documents in {result['wall_seconds']}s, "
+        f"{result['throughput_docs_per_min']} docs/min, "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+    print(
+        f"tokens: {result['prompt_tokens']} prompt, {result['output_tokens']} output"
+    )
+    content_tokens = result["content_tokens"]
+    print(
+        f"page content: {content_tokens['raw']} tokens, "
+        f"{content_tokens['compacted']} after compaction "
+        f"(-{1 - content_tokens['compacted'] / max(content_tokens['raw'], 1):.1%})"
+    )
+    print("documents by extraction path:", result["extraction_paths"])
+
+    rows = {"document": result["document_latency"], **result["node_latency"]}
+    print(pd.DataFrame(rows).T.to_string())
+
+    if result["routes"]:
+        print("documents by route:")
+        print(pd.DataFrame(result["routes"]).T.to_string())
+
+    print("pipeline stages:")
+    print(pd.DataFrame(result["stages"]).T.to_string())
+
+    if result["document_peak_memory_mb"]:
+        print("peak memory growth per document (MB):", result["document_peak_memory_mb"])
+
+    if result["accuracy"]:
+        print("accuracy:", result["accuracy"])
+
+    for error in result["errors"]:
+        print("error:", error)
+
+
+# Run by a fresh interpreter from the repository directory, argv[1] is a PDF
+COLD_START_SCRIPT = """
+import json, sys, time
+
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+from starlette.testclient import TestClient
+
+first_request_started = time.perf_counter()
+with TestClient(main.app) as client, open(sys.argv[1], "rb") as pdf:
+    response = client.post(
+        "/extract-bills",
+        params={"images": "none"},
+        files=[("bills", ("cold_start.pdf", pdf, "application/pdf"))],
+    )
+    response.raise_for_status()
+    first_request = time.perf_counter() - first_request_started
+
+print(json.dumps({"import": imported - started, "first_request": first_request}))
+"""
+
+
+def measure_cold_start(path: str, runs: int) -> dict:
+    """Import time of main and duration of the first /extract-bills request,
+    each run in a new process with the caches disabled"""
+
+    env = {**os.environ, "RESULT_CACHE_PATH": "", "PAGE_CACHE_PATH": ""}
+    imports, first_requests = [], []
+
+    for _ in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, os.path.abspath(path)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        timings = json.loads(completed.stdout.strip().splitlines()[-1])
+        imports.append(timings["import"])
+        first_requests.append(timings["first_request"])
+
+    return {
+        "import_seconds": percentiles(imports),
+        "first_request_seconds": percentiles(first_requests),
+    }
+
+
+def pdf_sort_key(name: str):
+    # test2.pdf before test10.pdf
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+async def main(args: argparse.Namespace):
+    # Every run OCRs its pages, or replays their cassettes. With the persistent
+    # page cache, the runs after the first would read the OCR from disk. It is
+    # dropped here rather than through PAGE_CACHE_PATH, bulk.py imports this
+    # module and keeps its cache.
+    workflow.page_cache = None
+
+    sampler = RssSampler()
+    sampler.start()
+
+    paths = [
+        os.path.join(args.data, name)
+        for name in sorted(os.listdir(args.data), key=pdf_sort_key)
+        if name.endswith(".pdf")
+    ]
+    expected = load_expected(args.expected) if args.expected else {}
+    results = []
+
+    for concurrency in args.concurrency:
+        result = report(await run(paths, concurrency, args.mode, sampler), expected)
+        print_report(result)
+        results.append(result)
+
+    sampler.stop()
+
+    # Children only count once they exited
+    shutdown_render_pool()
+    print(f"\npeak RSS of the render workers {peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB")
+
+    if args.cold_start_runs and paths:
+        cold_start = measure_cold_start(paths[0], args.cold_start_runs)
+        print("\ncold start import time (s):", cold_start["import_seconds"])
+        print("cold start first request (s):", cold_start["first_request_seconds"])
+        results.append({"cold_start": cold_start})
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default="tests/data", help="Directory of PDFs")
+    parser.add_argument(
+        "--expected",
+        default="tests/expected_results.json",
+        help="Expected results, empty to skip accuracy",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="Documents processed at the same time, one run per value",
+    )
+    parser.add_argument(
+        "--mode", choices=["two_step", "combined"], help="Graph mode, GRAPH_MODE by default"
+    )
+    parser.add_argument(
+        "--cold-start-runs",
+        type=int,
+        default=3,
+        help="Fresh processes timing import and first request, 0 to skip",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+
+    asyncio.run(main(parser.parse_args()))
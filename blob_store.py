@@ -0,0 +1,151 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+from pdf_source import PdfSource
+
+DOC_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobStore:
+    """On-disk store of source PDFs and their rendered pages.
+
+    Blobs live under ``root/<doc_id>/``, where the document id is the SHA-256
+    of the PDF bytes, so the same file uploaded twice maps to the same blobs.
+    Writes go through a temporary file and an atomic rename, concurrent
+    writers of the same blob never leave a partial file behind.
+
+    The modification time of a document directory is its last use. Documents
+    unused for ``ttl_seconds`` are dropped, then the least recently used ones
+    until the store fits ``max_bytes``. Eviction runs when a PDF is added, at
+    most every ``evict_interval`` seconds, as it walks the whole store.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int = 10 * 1024**3,
+        ttl_seconds: float = 30 * 24 * 3600,
+        evict_interval: float = 60,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_interval = evict_interval
+        self.evictions = 0
+        self._evicted_at = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, doc_id: str, name: str) -> str:
+        if not DOC_ID_PATTERN.match(doc_id):
+            raise ValueError(f"Invalid document id '{doc_id}'")
+
+        return os.path.join(self.root, doc_id, name)
+
+    def _read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as blob:
+                return blob.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: str, data: Union[bytes, memoryview]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+
+        with os.fdopen(fd, "wb") as blob:
+            blob.write(data)
+
+        os.replace(tmp_path, path)
+
+    def _touch(self, doc_id: str):
+        try:
+            os.utime(os.path.dirname(self._path(doc_id, "source.pdf")))
+        except FileNotFoundError:
+            pass
+
+    def has_pdf(self, doc_id: str) -> bool:
+        return os.path.exists(self._path(doc_id, "source.pdf"))
+
+    def put_pdf(self, doc_id: str, pdf: PdfSource):
+        if self.has_pdf(doc_id):
+            self._touch(doc_id)
+            return
+
+        with pdf.view() as view:
+            self._write(self._path(doc_id, "source.pdf"), view)
+
+        if time.time() - self._evicted_at >= self.evict_interval:
+            self.evict()
+
+    def get_pdf(self, doc_id: str) -> Optional[PdfSource]:
+        if not self.has_pdf(doc_id):
+            return None
+
+        self._touch(doc_id)
+
+        return PdfSource.from_file(self._path(doc_id, "source.pdf"))
+
+    def has_page(self, doc_id: str, page_no: int, fmt: str) -> bool:
+        return os.path.exists(self._path(doc_id, f"page-{page_no}.{fmt}"))
+
+    def get_page(self, doc_id: str, page_no: int, fmt: str) -> Optional[bytes]:
+        image = self._read(self._path(doc_id, f"page-{page_no}.{fmt}"))
+
+        if image is not None:
+            self._touch(doc_id)
+
+        return image
+
+    def put_page(self, doc_id: str, page_no: int, fmt: str, image: bytes):
+        self._write(self._path(doc_id, f"page-{page_no}.{fmt}"), image)
+
+    def _documents(self) -> List[Tuple[float, int, str]]:
+        """Last use, size and directory of every document of the store"""
+
+        documents = []
+
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return documents
+
+        for entry in entries:
+            if not entry.is_dir() or not DOC_ID_PATTERN.match(entry.name):
+                continue
+
+            try:
+                size = sum(blob.stat().st_size for blob in os.scandir(entry.path))
+                documents.append((entry.stat().st_mtime, size, entry.path))
+            except FileNotFoundError:
+                continue
+
+        return documents
+
+    def evict(self, now: Optional[float] = None) -> int:
+        """Drop the expired documents, then the least recently used ones until
+        the store fits ``max_bytes``. Returns the number of documents dropped."""
+
+        now = now or time.time()
+
+        with self._lock:
+            self._evicted_at = now
+            documents = sorted(self._documents())
+            size = sum(document_size for _, document_size, _ in documents)
+            evicted = 0
+
+            for used, document_size, path in documents:
+                if used >= now - self.ttl_seconds and size <= self.max_bytes:
+                    break
+
+                shutil.rmtree(path, ignore_errors=True)
+                size -= document_size
+                evicted += 1
+
+            self.evictions += evicted
+
+        return evicted
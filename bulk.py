@@ -0,0 +1,343 @@
+"""Resumable bulk extraction of a directory or manifest of PDF bills.
+
+Files are processed with bounded concurrency, page images are rendered on the
+render process pool, and bills are written to JSONL or Parquet as documents
+complete. The hash of every finished document is appended to a checkpoint
+file, so an interrupted run picks up where it stopped:
+
+    python bulk.py bills/ --output bills.jsonl --concurrency 16
+    python bulk.py manifest.txt --output bills_parquet --format parquet
+
+A manifest lists one PDF path per line, relative to the manifest directory.
+
+For backfills that need no interactive latency, ``--batch gemini`` sends the
+Gemini calls of all the documents in flight as provider batches, at batch
+pricing and outside the rate limits of the interactive API. Documents go
+through the combined graph, one call for classification and bills, so most
+wait for a single batch turnaround; those whose answer fails validation wait
+for one or two more, for the retry or the two step fallback. ``--batch file``
+runs the same mode offline, answering batches from the recorded cassettes:
+
+    python bulk.py bills/ --output bills.jsonl --batch gemini
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List
+
+import pandas as pd
+
+from batching import (
+    BATCH_BACKENDS,
+    BATCH_DIR,
+    BATCH_MAX_REQUESTS,
+    Batcher,
+    FileBatchBackend,
+    active_batcher,
+)
+from benchmark import pdf_sort_key, percentiles
+from metrics import LATENCY_BUCKETS
+from pdf_source import PdfSource
+from rendering import shutdown_render_pool
+from workflow import aprocess_bill_pdf
+
+
+def list_pdfs(source: str) -> List[str]:
+    """PDF paths of a directory, recursively, or of a manifest file"""
+
+    if os.path.isdir(source):
+        return sorted(
+            (
+                os.path.join(root, name)
+                for root, _, names in os.walk(source)
+                for name in names
+                if name.lower().endswith(".pdf")
+            ),
+            key=pdf_sort_key,
+        )
+
+    base = os.path.dirname(source)
+
+    with open(source) as manifest:
+        return [
+            os.path.join(base, line.strip())
+            for line in manifest
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def load_checkpoint(path: str) -> set[str]:
+    if not os.path.exists(path):
+        return set()
+
+    with open(path) as checkpoint:
+        return {line.strip() for line in checkpoint if line.strip()}
+
+
+class ResultWriter:
+    """Writes bill rows and marks their documents done in the checkpoint, in
+    that order, so a document is never checkpointed without its rows.
+
+    JSONL rows are appended as each document completes. Parquet files cannot
+    be appended to, so rows are buffered and written as a new part file of
+    the output directory every ``batch_size`` documents.
+    """
+
+    def __init__(self, output: str, format: str, checkpoint: str, batch_size: int):
+        self.output = output
+        self.format = format
+        self.batch_size = batch_size
+        self._rows: List[dict] = []
+        self._digests: List[str] = []
+
+        if format == "parquet":
+            # Fail before processing anything when no Parquet engine is installed
+            pd.io.parquet.get_engine("auto")
+            os.makedirs(output, exist_ok=True)
+            self._file = None
+        else:
+            self._file = open(output, "a")
+
+        self._checkpoint = open(checkpoint, "a")
+
+    def add(self, digest: str, rows: List[dict]):
+        self._rows.extend(rows)
+        self._digests.append(digest)
+
+        if self.format == "jsonl" or len(self._digests) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._digests:
+            return
+
+        if self.format == "parquet":
+            if self._rows:
+                part = f"part-{time.time_ns()}.parquet"
+                pd.DataFrame(self._rows).to_parquet(os.path.join(self.output, part))
+        else:
+            for row in self._rows:
+                self._file.write(json.dumps(row) + "\n")
+            self._file.flush()
+
+        self._checkpoint.write("".join(f"{digest}\n" for digest in self._digests))
+        self._checkpoint.flush()
+        os.fsync(self._checkpoint.fileno())
+
+        self._rows = []
+        self._digests = []
+
+    def close(self):
+        self.flush()
+
+        if self._file:
+            self._file.close()
+        self._checkpoint.close()
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.skipped = 0
+        self.done = 0
+        self.pages = 0
+        self.errors: List[str] = []
+        self.latencies: List[float] = []
+        self.started = time.perf_counter()
+
+    def line(self) -> str:
+        minutes = max(time.perf_counter() - self.started, 1e-9) / 60
+
+        return (
+            f"{self.done + len(self.errors) + self.skipped}/{self.total} files, "
+            f"{self.done} done, {self.skipped} skipped, {len(self.errors)} failed, "
+            f"{self.done / minutes:.1f} docs/min, {self.pages / minutes:.1f} pages/min"
+        )
+
+
+def page_count(pdf: PdfSource) -> int:
+    with pdf.open() as pdf_document:
+        return len(pdf_document)
+
+
+async def process_file(
+    path: str,
+    name: str,
+    images: str,
+    finished: set[str],
+    writer: ResultWriter,
+    progress: Progress,
+):
+    # Files are read from disk by the workflow, never loaded whole in memory
+    pdf = PdfSource.from_file(path)
+    digest = await asyncio.to_thread(pdf.sha256)
+
+    # Finished in an earlier run, or a copy of a file of this run
+    if digest in finished:
+        progress.skipped += 1
+        return
+    finished.add(digest)
+
+    started = time.perf_counter()
+
+    try:
+        pages = await asyncio.to_thread(page_count, pdf)
+        address, bills = await aprocess_bill_pdf(pdf, name, images)
+    except Exception as error:
+        finished.discard(digest)
+        progress.errors.append(f"{name}: {error!r}")
+        print(f"error: {name}: {error!r}", file=sys.stderr)
+        return
+
+    progress.latencies.append(time.perf_counter() - started)
+    progress.done += 1
+    progress.pages += pages
+
+    writer.add(
+        digest,
+        [
+            {"path": name, "digest": digest, "address": address, **bill.model_dump()}
+            for bill in bills
+        ],
+    )
+
+
+def latency_histogram(latencies: List[float], width: int = 40) -> str:
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    for latency in latencies:
+        index = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound),
+            len(LATENCY_BUCKETS),
+        )
+        counts[index] += 1
+
+    labels = [f"<= {bound}s" for bound in LATENCY_BUCKETS] + [
+        f"> {LATENCY_BUCKETS[-1]}s"
+    ]
+    largest = max(counts) or 1
+
+    return "\n".join(
+        f"{label:>10} {count:>6} {'#' * round(width * count / largest)}"
+        for label, count in zip(labels, counts)
+        if count
+    )
+
+
+async def report_progress(progress: Progress, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        print(progress.line(), file=sys.stderr)
+
+
+async def main(args: argparse.Namespace):
+    paths = list_pdfs(args.source)
+    base = args.source if os.path.isdir(args.source) else os.path.dirname(args.source)
+    checkpoint = args.checkpoint or f"{args.output.rstrip('/')}.checkpoint"
+    finished = load_checkpoint(checkpoint)
+
+    writer = ResultWriter(args.output, args.format, checkpoint, args.batch_size)
+    progress = Progress(len(paths))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    for path in paths:
+        queue.put_nowait(path)
+
+    async def work():
+        while not queue.empty():
+            path = queue.get_nowait()
+            await process_file(
+                path, os.path.relpath(path, base), args.images, finished, writer, progress
+            )
+
+    if args.batch == "file":
+        active_batcher.set(Batcher(FileBatchBackend(args.batch_dir)))
+    elif args.batch:
+        active_batcher.set(Batcher(BATCH_BACKENDS[args.batch]()))
+
+    # A batch only collects the calls of the documents in flight
+    concurrency = args.concurrency or (BATCH_MAX_REQUESTS if args.batch else 32)
+    reporter = asyncio.create_task(report_progress(progress, args.progress_interval))
+
+    try:
+        await asyncio.gather(*(work() for _ in range(concurrency)))
+    finally:
+        reporter.cancel()
+        writer.close()
+        shutdown_render_pool()
+
+    print(progress.line())
+
+    if active_batcher.get():
+        print("batches:", active_batcher.get().batches)
+
+    if progress.latencies:
+        print("document latency:", percentiles(progress.latencies))
+        print(latency_histogram(progress.latencies))
+
+    for error in progress.errors:
+        print("error:", error)
+
+    if progress.errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="Directory of PDFs, or manifest of PDF paths")
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="JSONL file, or directory of Parquet part files",
+    )
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument(
+        "--checkpoint",
+        help="File of the finished document hashes, <output>.checkpoint by default",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help=(
+            "Documents processed at the same time, 32 by default and capped by "
+            "PIPELINE_CONCURRENCY, or BATCH_MAX_REQUESTS and uncapped with --batch"
+        ),
+    )
+    parser.add_argument(
+        "--images",
+        choices=["inline", "ref", "none"],
+        default="none",
+        help="'inline' writes base64 page images, 'ref' keeps the PDFs in the blob store",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Documents per Parquet part file",
+    )
+    parser.add_argument(
+        "--batch",
+        choices=sorted(BATCH_BACKENDS),
+        help=(
+            "Send Gemini calls as provider batches, or as local file batches. Each "
+            "document waits for one batch turnaround, up to hours on the provider, "
+            "and for more when its answer fails validation"
+        ),
+    )
+    parser.add_argument(
+        "--batch-dir",
+        default=BATCH_DIR,
+        help="Directory of the local file batches",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=10,
+        help="Seconds between throughput reports",
+    )
+
+    asyncio.run(main(parser.parse_args()))
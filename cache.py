@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from api_entites import BillData
+
+
+def evict(
+    db: sqlite3.Connection,
+    table: str,
+    now: float,
+    ttl_seconds: float,
+    max_entries: int,
+    max_bytes: int,
+) -> int:
+    """Drop the expired entries of a cache table, then the least recently used
+    ones until it fits ``max_entries`` and ``max_bytes``. Returns the number
+    of entries dropped."""
+
+    expired = max(
+        db.execute(
+            f"DELETE FROM {table} WHERE created < ?", (now - ttl_seconds,)
+        ).rowcount,
+        0,
+    )
+
+    count, size = db.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {table}"
+    ).fetchone()
+
+    if count <= max_entries and size <= max_bytes:
+        return expired
+
+    # Walk from the least recently used entry until both limits hold
+    rows = db.execute(f"SELECT key, size FROM {table} ORDER BY accessed ASC").fetchall()
+    evicted = []
+
+    for key, entry_size in rows:
+        if count <= max_entries and size <= max_bytes:
+            break
+        evicted.append((key,))
+        count -= 1
+        size -= entry_size
+
+    db.executemany(f"DELETE FROM {table} WHERE key = ?", evicted)
+
+    return expired + len(evicted)
+
+
+class ResultCache:
+    """Persistent cache of processed PDFs, backed by SQLite.
+
+    Entries are keyed by the SHA-256 of the PDF bytes and the pipeline version
+    stamp, so a change of prompts, models or schemas never returns stale
+    results. Expired entries are dropped on read and write; when the cache
+    grows over ``max_entries`` or ``max_bytes`` the least recently used
+    entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        version: str,
+        max_entries: int = 10_000,
+        max_bytes: int = 2 * 1024**3,
+        ttl_seconds: float = 30 * 24 * 3600,
+    ):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+        )
+        self._db.commit()
+
+    def key(self, digest: str) -> str:
+        return f"{digest}:{self.version}"
+
+    def get(self, digest: str, filename: str) -> Optional[Tuple[str, List[BillData]]]:
+        """Return the cached result for a PDF hash, with bills renamed to ``filename``"""
+
+        now = time.time()
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, created FROM results WHERE key = ?",
+                (self.key(digest),),
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._db.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?",
+                (now, self.key(digest)),
+            )
+            self._db.commit()
+
+        value = json.loads(row[0])
+        bills = [
+            BillData(**{**bill, "file_name": filename}) for bill in value["bills"]
+        ]
+
+        return value["address"], bills
+
+    def set(self, digest: str, address: Optional[str], bills: List[BillData]):
+        value = json.dumps(
+            {"address": address, "bills": [bill.model_dump() for bill in bills]}
+        )
+        now = time.time()
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (self.key(digest), value, len(value), now, now),
+            )
+            self.evictions += evict(
+                self._db, "results", now, self.ttl_seconds, self.max_entries, self.max_bytes
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results"
+            ).fetchone()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": size,
+        }
+
+
+class PageCache:
+    """Persistent cache of OCR markdown per page, backed by SQLite.
+
+    Entries are keyed by a fingerprint of the page content and the OCR model,
+    so a page shared by several PDFs, e.g. an old statement repeated in every
+    later bundle, is only OCR'd once. It does not depend on the pipeline
+    version: OCR output does not change with prompts or schemas.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model: str,
+        max_entries: int = 200_000,
+        max_bytes: int = 2 * 1024**3,
+        ttl_seconds: float = 90 * 24 * 3600,
+    ):
+        self.path = path
+        self.model = model
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                markdown TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)")
+        self._db.commit()
+
+    def key(self, fingerprint: str) -> str:
+        return f"{fingerprint}:{self.model}"
+
+    def get_many(self, fingerprints: Iterable[str]) -> dict[str, str]:
+        """Return the cached markdown of the pages found, by fingerprint"""
+
+        fingerprints = set(fingerprints)
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            for fingerprint in fingerprints:
+                row = self._db.execute(
+                    "SELECT markdown, created FROM pages WHERE key = ?",
+                    (self.key(fingerprint),),
+                ).fetchone()
+
+                if row is not None and now - row[1] <= self.ttl_seconds:
+                    found[fingerprint] = row[0]
+
+            self._db.executemany(
+                "UPDATE pages SET accessed = ? WHERE key = ?",
+                [(now, self.key(fingerprint)) for fingerprint in found],
+            )
+            self._db.commit()
+
+            self.hits += len(found)
+            self.misses += len(fingerprints) - len(found)
+
+        return found
+
+    def set_many(self, markdown_by_fingerprint: dict[str, str]):
+        now = time.time()
+
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                [
+                    (self.key(fingerprint), markdown, len(markdown), now, now)
+                    for fingerprint, markdown in markdown_by_fingerprint.items()
+                ],
+            )
+            self.evictions += evict(
+                self._db, "pages", now, self.ttl_seconds, self.max_entries, self.max_bytes
+            )
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": size,
+        }
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
+# "off" calls the providers, "record" calls them and saves every response,
+# "replay" answers from the saved responses without any network access
+CASSETTE_MODE = os.environ.get("CASSETTE_MODE", "off")
+CASSETTE_DIR = os.environ.get("CASSETTE_DIR", "tests/cassettes")
+
+# Replayed calls sleep for the recorded latency times CASSETTE_LATENCY_SCALE,
+# or for CASSETTE_LATENCY seconds when set, plus or minus CASSETTE_JITTER
+CASSETTE_LATENCY_SCALE = float(os.environ.get("CASSETTE_LATENCY_SCALE", "1"))
+CASSETTE_LATENCY = os.environ.get("CASSETTE_LATENCY")
+CASSETTE_JITTER = float(os.environ.get("CASSETTE_JITTER", "0"))
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+def cassette_key(kind: str, model: str, request: Any) -> str:
+    payload = json.dumps([kind, model, request], sort_keys=True, default=str)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def replay_latency(recorded: float) -> float:
+    latency = (
+        float(CASSETTE_LATENCY)
+        if CASSETTE_LATENCY is not None
+        else recorded * CASSETTE_LATENCY_SCALE
+    )
+
+    return max(0.0, latency + random.uniform(-CASSETTE_JITTER, CASSETTE_JITTER))
+
+
+async def play(
+    kind: str,
+    model: str,
+    request: Any,
+    response_type: type[T],
+    call: Callable[[], Awaitable[T]],
+) -> T:
+    """Run a provider call through the cassette layer.
+
+    ``request`` is whatever identifies the call (prompt, schema, document
+    hash...), it is only used to derive the cassette key. Responses are
+    stored as JSON under ``CASSETTE_DIR/<kind>/<key>.json`` with the latency
+    observed while recording.
+    """
+
+    if CASSETTE_MODE == "off":
+        return await call()
+
+    key = cassette_key(kind, model, request)
+    path = os.path.join(CASSETTE_DIR, kind, f"{key}.json")
+
+    if CASSETTE_MODE == "replay":
+        try:
+            with open(path) as cassette:
+                recorded = json.load(cassette)
+        except FileNotFoundError as error:
+            raise CassetteMiss(
+                f"No {kind} cassette for {model} ({key}), record it first"
+            ) from error
+
+        await asyncio.sleep(replay_latency(recorded["latency"]))
+
+        return response_type.model_validate(recorded["response"])
+
+    started = time.perf_counter()
+    response = await call()
+    latency = time.perf_counter() - started
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as cassette:
+        json.dump(
+            {
+                "kind": kind,
+                "model": model,
+                "latency": latency,
+                "response": response.model_dump(mode="json", exclude_none=True),
+            },
+            cassette,
+        )
+
+    return response
@@ -0,0 +1,112 @@
+import math
+import re
+from collections import Counter
+from typing import Iterable, List
+
+from page_signals import page_signals
+
+IMAGE_LINK = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+TABLE_SEPARATOR = re.compile(r"^\|?(?:\s*:?-+:?\s*\|)+\s*:?-*:?\s*$")
+CELL_PADDING = re.compile(r"[ \t]*\|[ \t]*")
+SPACES = re.compile(r"[ \t\u00a0]{2,}")
+
+# Header and footer lines: the first and last BOILERPLATE_LINES non-empty
+# lines of a page. Such a line is boilerplate when it is found on at least
+# half of the pages, and on BOILERPLATE_MIN_PAGES pages.
+BOILERPLATE_LINES = 3
+BOILERPLATE_MIN_PAGES = 3
+
+
+def apply_image_annotations(markdown: str, images: Iterable) -> str:
+    """Replace the links of the images of an OCR page with their annotations"""
+
+    for image in images:
+        if image.id and image.image_annotation:
+            markdown = markdown.replace(f"![{image.id}]({image.id})", image.image_annotation)
+
+    return markdown
+
+
+def compact_lines(text: str) -> List[str]:
+    """Lines of a page without image links, table separator rows, cell
+    padding, indentation and runs of blank lines. Runs of spaces are kept as
+    two spaces, they separate the columns of text layer pages."""
+
+    lines = []
+
+    for line in text.splitlines():
+        # Links of images left without an annotation are only an image id
+        line = IMAGE_LINK.sub("", line).strip()
+
+        if TABLE_SEPARATOR.match(line):
+            continue
+
+        if "|" in line:
+            line = CELL_PADDING.sub("|", line)
+        line = SPACES.sub("  ", line)
+
+        if line or (lines and lines[-1]):
+            lines.append(line)
+
+    while lines and not lines[-1]:
+        lines.pop()
+
+    return lines
+
+
+def is_signal_free(line: str) -> bool:
+    return not any(page_signals(line).values())
+
+
+def boilerplate(pages: dict[int, List[str]]) -> set[str]:
+    """Header and footer lines repeated across the pages. Lines with dates,
+    amounts or bill keywords are never boilerplate, they may belong to a bill
+    of a statement bundle."""
+
+    if len(pages) < BOILERPLATE_MIN_PAGES:
+        return set()
+
+    counts = Counter()
+
+    for lines in pages.values():
+        non_empty = [line for line in lines if line]
+        counts.update(set(non_empty[:BOILERPLATE_LINES] + non_empty[-BOILERPLATE_LINES:]))
+
+    threshold = max(BOILERPLATE_MIN_PAGES, math.ceil(len(pages) / 2))
+
+    return {
+        line
+        for line, count in counts.items()
+        if count >= threshold and is_signal_free(line)
+    }
+
+
+def compact_pages(pages: dict[int, str]) -> dict[int, str]:
+    """Shrink the page content sent to the model. Whitespace and table
+    padding are collapsed, and boilerplate is only kept on the first page it
+    is found on."""
+
+    lines = {page_no: compact_lines(pages[page_no]) for page_no in sorted(pages)}
+    repeated = boilerplate(lines)
+    seen = set()
+    compacted = {}
+
+    for page_no, page_lines in lines.items():
+        kept = []
+
+        for line in page_lines:
+            if line in repeated:
+                if line in seen:
+                    continue
+                seen.add(line)
+            kept.append(line)
+
+        compacted[page_no] = "\n".join(kept)
+
+    return compacted
+
+
+def join_pages(pages: dict[int, str], page_nos: Iterable[int]) -> str:
+    """Prompt content of the pages, each under its page number"""
+
+    return "".join(f"\n\nPAGE NUMBER :{page_no}\n{pages[page_no]}" for page_no in page_nos)
@@ -0,0 +1,75 @@
+"""Compare the two_step and combined graph modes on the PDFs in tests/data.
+
+Prints per document latency, prompt size, Gemini token usage and the number
+of LLM calls for each mode, followed by the totals. Set PAGE_FILTER=0 to
+measure the prompt size without the page relevance filter.
+
+    python compare_modes.py [pdf_dir]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import pandas as pd
+
+from workflow import arun_graph
+
+
+async def measure(path: str, mode: str) -> dict:
+    with open(path, "rb") as pdf:
+        pdf_bytes = pdf.read()
+
+    started = time.perf_counter()
+    final_state = await arun_graph(pdf_bytes, mode=mode)
+    latency = time.perf_counter() - started
+
+    llm_calls = final_state["llm_calls"]
+
+    return {
+        "file": os.path.basename(path),
+        "mode": mode,
+        "pages": f"{len(final_state['selected_pages'])}/{len(final_state['pages'])}",
+        "content_chars": len(final_state["content"]),
+        "latency": round(latency, 2),
+        "llm_latency": round(sum(call["latency"] for call in llm_calls), 2),
+        "prompt_tokens": sum(call["prompt_tokens"] for call in llm_calls),
+        "output_tokens": sum(call["output_tokens"] for call in llm_calls),
+        "llm_calls": " > ".join(call["node"] for call in llm_calls),
+        "bills": len(final_state["bills"]),
+    }
+
+
+async def main(pdf_dir: str):
+    paths = sorted(
+        os.path.join(pdf_dir, name)
+        for name in os.listdir(pdf_dir)
+        if name.endswith(".pdf")
+    )
+    rows = []
+
+    for path in paths:
+        for mode in ("two_step", "combined"):
+            rows.append(await measure(path, mode))
+
+    results = pd.DataFrame(rows)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(results.to_string(index=False))
+        print()
+        print(
+            results.groupby("mode")[
+                [
+                    "content_chars",
+                    "latency",
+                    "llm_latency",
+                    "prompt_tokens",
+                    "output_tokens",
+                ]
+            ].agg(["sum", "mean"])
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "tests/data"))
@@ -0,0 +1,259 @@
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from metrics import registry
+from stages import LoopLocal
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are worth
+    retrying, anything else (bad request, auth, schema errors) is not."""
+
+    # Both provider SDKs are built on httpx, it is loaded by the time they fail
+    import httpx
+
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+
+    # google-genai errors carry `code`, mistralai errors carry `status_code`
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+
+    return status in RETRYABLE_STATUS_CODES
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average, with bursts of up
+    to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = LoopLocal(asyncio.Lock)
+
+    async def acquire(self):
+        async with self._lock.get():
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ProviderGovernor:
+    """Shared gate in front of every provider call.
+
+    Each call waits for a token of its model's bucket, then for one of the
+    ``max_in_flight`` slots shared by all models. Retryable failures are
+    retried with full-jitter exponential backoff, and the whole call, retries
+    included, is abandoned once ``deadline`` seconds have passed.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: dict[str, float],
+        default_requests_per_minute: float = 600,
+        max_in_flight: int = 16,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20,
+        deadline: float = 120,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.default_requests_per_minute = default_requests_per_minute
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+        self._buckets: dict[str, TokenBucket] = {}
+        self._in_flight = LoopLocal(lambda: asyncio.Semaphore(max_in_flight))
+        self._stats: dict[str, dict[str, float]] = defaultdict(
+            lambda: {
+                "calls": 0,
+                "retries": 0,
+                "failures": 0,
+                "queue_wait_seconds": 0.0,
+                "queue_wait_max_seconds": 0.0,
+            }
+        )
+
+    def bucket(self, model: str) -> TokenBucket:
+        if model not in self._buckets:
+            rate = (
+                self.requests_per_minute.get(model, self.default_requests_per_minute)
+                / 60
+            )
+            # Allow a burst of about one second worth of requests
+            self._buckets[model] = TokenBucket(rate, capacity=max(1.0, rate))
+
+        return self._buckets[model]
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def call(
+        self,
+        model: str,
+        request: Callable[[], Awaitable[T]],
+        deadline: Optional[float] = None,
+    ) -> T:
+        """Run ``request`` under the model's rate limit and retry policy"""
+
+        stats = self._stats[model]
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+
+        while True:
+            queued = time.monotonic()
+            await self.bucket(model).acquire()
+
+            async with self._in_flight.get():
+                waited = time.monotonic() - queued
+                stats["calls"] += 1
+                stats["queue_wait_seconds"] += waited
+                stats["queue_wait_max_seconds"] = max(
+                    stats["queue_wait_max_seconds"], waited
+                )
+
+                try:
+                    return await asyncio.wait_for(
+                        request(), max(deadline_at - time.monotonic(), 0)
+                    )
+                except Exception as error:
+                    delay = self.backoff(attempt)
+
+                    if (
+                        not is_retryable(error)
+                        or attempt >= self.max_retries
+                        or time.monotonic() + delay >= deadline_at
+                    ):
+                        stats["failures"] += 1
+                        raise
+
+            stats["retries"] += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        return {model: dict(stats) for model, stats in self._stats.items()}
+
+
+def parse_requests_per_minute(value: str) -> dict[str, float]:
+    """Parse ``model=rpm,model=rpm`` settings"""
+
+    limits = {}
+
+    for item in value.split(","):
+        if "=" in item:
+            model, rpm = item.split("=", 1)
+            limits[model.strip()] = float(rpm)
+
+    return limits
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+class FakeProvider:
+    """Offline stand-in for a provider call, with configurable latency and a
+    share of calls failing with 429, to exercise the governor without
+    spending API budget.
+
+        provider = FakeProvider(latency=0.2, error_rate=0.3)
+        await governor.call("gemini-2.5-flash", provider)
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        result=None,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.result = result
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+
+    async def __call__(self):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            await asyncio.sleep(
+                max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            )
+
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                raise RateLimited("429 RESOURCE_EXHAUSTED")
+
+            return self.result
+        finally:
+            self.in_flight -= 1
+
+
+def collect_governor_metrics():
+    stats = governor.stats()
+    families = [
+        ("calls", "bill_parser_provider_calls_total", "Provider call attempts"),
+        ("retries", "bill_parser_provider_retries_total", "Provider calls retried"),
+        ("failures", "bill_parser_provider_failures_total", "Provider calls given up"),
+        (
+            "queue_wait_seconds",
+            "bill_parser_provider_queue_wait_seconds_total",
+            "Time spent waiting for the rate limit and the in-flight cap",
+        ),
+    ]
+
+    return [
+        (
+            name,
+            f"{help}, by model",
+            "counter",
+            [({"model": model}, values[key]) for model, values in stats.items()],
+        )
+        for key, name, help in families
+    ]
+
+
+governor = ProviderGovernor(
+    requests_per_minute=parse_requests_per_minute(
+        os.environ.get(
+            "PROVIDER_RPM",
+            "mistral-ocr-latest=360,gemini-2.5-flash=1000,gemini-2.5-flash-lite=4000",
+        )
+    ),
+    default_requests_per_minute=float(os.environ.get("PROVIDER_DEFAULT_RPM", "600")),
+    max_in_flight=int(os.environ.get("PROVIDER_MAX_IN_FLIGHT", "24")),
+    max_retries=int(os.environ.get("PROVIDER_MAX_RETRIES", "4")),
+    deadline=float(os.environ.get("PROVIDER_DEADLINE", "120")),
+)
+
+registry.register_collector(collect_governor_metrics)
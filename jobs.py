@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List, Optional, Tuple
+
+from api_entites import JobFile, JobStatus
+from metrics import registry
+from pdf_source import PdfSource
+from workflow import ImageMode, aprocess_bill_pdf
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "32"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "200"))
+
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = float(os.environ.get("JOB_TTL", "3600"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue(ABC):
+    """Queue of ``(job_id, file_index)`` work items feeding the job workers.
+
+    Items are plain tuples so a queue backed by an external broker, e.g. a
+    Redis list, can replace the in-process one by implementing these methods.
+    """
+
+    maxsize: int
+
+    @abstractmethod
+    def put_nowait(self, item: Tuple[str, int]):
+        """Enqueue an item, raise QueueFull when the queue is at capacity"""
+
+    @abstractmethod
+    async def get(self) -> Tuple[str, int]: ...
+
+    @abstractmethod
+    def qsize(self) -> int: ...
+
+
+class InProcessQueue(JobQueue):
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def put_nowait(self, item: Tuple[str, int]):
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull as error:
+            raise QueueFull() from error
+
+    async def get(self) -> Tuple[str, int]:
+        return await self._queue.get()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class Job:
+    def __init__(self, uploads: List[Tuple[str, PdfSource]], images: ImageMode):
+        self.job_id = uuid.uuid4().hex
+        self.images = images
+        self.files = [JobFile(file_name=filename) for filename, _ in uploads]
+        self.sources: List[Optional[PdfSource]] = [pdf for _, pdf in uploads]
+        self.finished_at: Optional[float] = None
+
+        # Append only log of (event, data) streamed to the clients
+        self.events: List[Tuple[str, dict]] = []
+        self._changed = asyncio.Condition()
+
+    def status(self) -> JobStatus:
+        if self.finished_at:
+            status = "done"
+        elif all(file.status == "queued" for file in self.files):
+            status = "queued"
+        else:
+            status = "running"
+
+        return JobStatus(job_id=self.job_id, status=status, files=self.files)
+
+    async def publish(self, event: str, data: dict):
+        async with self._changed:
+            self.events.append((event, data))
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[Tuple[str, dict]]:
+        """Yield every event of the job, past and future, until it is done"""
+
+        index = 0
+
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.events) > index)
+                pending = self.events[index:]
+
+            for event, data in pending:
+                yield event, data
+
+                if event == "done":
+                    return
+
+            index += len(pending)
+
+
+class JobManager:
+    """Runs extraction jobs on a fixed pool of worker tasks.
+
+    Every file of a job is a separate queue item, so the files of one job are
+    processed concurrently and large jobs interleave with small ones. When the
+    queue cannot take all the files of a new job, the submission is rejected
+    with QueueFull instead of growing the backlog without bound.
+    """
+
+    def __init__(self, queue: JobQueue, workers: int):
+        self.queue = queue
+        self.workers = workers
+        self.jobs: dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._work()) for _ in range(self.workers)
+            ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, uploads: List[Tuple[str, PdfSource]], images: ImageMode) -> Job:
+        """Queue the files of a new job, which then owns and closes their sources"""
+
+        self.start()
+        self._forget_finished()
+
+        if self.queue.maxsize - self.queue.qsize() < len(uploads):
+            raise QueueFull()
+
+        job = Job(uploads, images)
+        self.jobs[job.job_id] = job
+
+        for index in range(len(uploads)):
+            self.queue.put_nowait((job.job_id, index))
+
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _forget_finished(self):
+        now = time.time()
+
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at and now - job.finished_at > JOB_TTL:
+                del self.jobs[job_id]
+
+    async def _work(self):
+        while True:
+            job_id, index = await self.queue.get()
+            job = self.jobs.get(job_id)
+
+            if job is not None:
+                await self._process(job, index)
+
+    async def _process(self, job: Job, index: int):
+        file = job.files[index]
+        pdf = job.sources[index]
+        file.status = "running"
+
+        try:
+            address, bills = await aprocess_bill_pdf(
+                pdf, file.file_name, job.images, on_node=file.nodes.append
+            )
+        except Exception as error:
+            logger.error(
+                "Job %s failed to process '%s'", job.job_id, file.file_name, exc_info=error
+            )
+            file.status = "failed"
+            file.error = str(error)
+            await job.publish(
+                "error", {"file_name": file.file_name, "detail": file.error}
+            )
+        else:
+            file.status = "done"
+            file.address = address
+            file.bills = bills
+
+            for bill in bills:
+                await job.publish("bill", bill.model_dump())
+        finally:
+            # The spooled upload is not needed anymore
+            pdf.close()
+            job.sources[index] = None
+
+        if all(file.status in ("done", "failed") for file in job.files):
+            job.finished_at = time.time()
+            await job.publish("done", job.status().model_dump(include={"job_id", "status"}))
+
+
+job_manager = JobManager(InProcessQueue(JOB_QUEUE_SIZE), JOB_WORKERS)
+
+
+def collect_job_metrics():
+    statuses = [job.status().status for job in job_manager.jobs.values()]
+
+    return [
+        (
+            "bill_parser_job_queue_depth",
+            "Files waiting in the job queue",
+            "gauge",
+            [({}, job_manager.queue.qsize())],
+        ),
+        (
+            "bill_parser_jobs",
+            "Jobs known to the job manager, by status",
+            "gauge",
+            [
+                ({"status": status}, sum(job_status == status for job_status in statuses))
+                for status in ("queued", "running", "done")
+            ],
+        ),
+    ]
+
+
+registry.register_collector(collect_job_metrics)
@@ -1,19 +1,63 @@
-from workflow import process_bill_pdf
+from workflow import ImageMode, aprocess_bill_pdf, aget_page_image, has_page, warm_up
+from metrics import registry, request_breakdown, server_timing
+from blob_store import DOC_ID_PATTERN
+from rendering import shutdown_render_pool
+from pdf_source import NotAPdf, PdfSource, PdfTooLarge, spool_upload
+from jobs import QueueFull, job_manager
+from providers import missing_settings
 from api_entites import (
     ExtractResponse,
     RootResponse,
     DateInfo,
     BillData,
+    FileError,
+    HealthResponse,
+    ReadyResponse,
+    JobCreated,
+    JobStatus,
 )
 from typing_extensions import Literal
-from typing import Optional, List
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
+from typing import Optional, List, Tuple
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
+import json
+import logging
 import os
+import time
 
 from fastapi.middleware.cors import CORSMiddleware
 
 
+logger = logging.getLogger(__name__)
+
+# Default number of files of a single request processed at the same time,
+# the process wide limit is PIPELINE_CONCURRENCY in workflow.py
+REQUEST_CONCURRENCY = int(os.environ.get("REQUEST_CONCURRENCY", "4"))
+
+# Uploads are spooled to disk, these bound the size of one file and of all
+# the files of one request
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(100 * 1024**2)))
+MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", str(500 * 1024**2)))
+
+STARTED_AT = time.monotonic()
+
+# Duration of the warm-up, None until it ran
+warmup_seconds: Optional[float] = None
+_warmup_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_manager.start()
+    yield
+    await job_manager.stop()
+    await asyncio.to_thread(shutdown_render_pool)
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Bill Parser API",
     description="""
     Water Bill Data Extraction API
@@ -50,6 +94,10 @@ app = FastAPI(
             "name": "extraction",
             "description": "PDF bill data extraction endpoints",
         },
+        {
+            "name": "jobs",
+            "description": "Asynchronous extraction jobs for large batches",
+        },
         {
             "name": "health",
             "description": "API health and status monitoring",
@@ -88,6 +136,11 @@ async def root():
             "status": "running",
             "endpoints": {
                 "extract_bills": "/extract-bills",
+                "bill_pages": "/bills/{doc_id}/pages/{n}.{fmt}",
+                "jobs": "/jobs",
+                "health": "/health",
+                "ready": "/ready",
+                "metrics": "/metrics",
                 "docs": "/docs",
             }
         }
@@ -98,13 +151,122 @@ async def root():
         "status": "running",
         "endpoints": {
             "extract_bills": "/extract-bills",
+            "bill_pages": "/bills/{doc_id}/pages/{n}.{fmt}",
+            "jobs": "/jobs",
+            "health": "/health",
+            "ready": "/ready",
+            "metrics": "/metrics",
             "docs": "/docs",
         },
     }
 
 
+@app.get("/health", response_model=HealthResponse, tags=["health"])
+async def health():
+    """
+    Liveness check, answers as long as the event loop is responsive
+    """
+    return HealthResponse(
+        uptime_seconds=round(time.monotonic() - STARTED_AT, 3),
+        jobs_queued=job_manager.queue.qsize(),
+    )
+
+
+@app.get("/ready", response_model=ReadyResponse, tags=["health"])
+async def ready(
+    response: Response,
+    warmup: bool = Query(
+        False,
+        description="Create the provider clients and compile the graphs before answering",
+    ),
+):
+    """
+    Readiness check: the provider settings are present. With warmup=true the
+    SDK imports, client creation and graph compilation otherwise paid by the
+    first request are done now, once, and the answer waits for them
+    """
+    global warmup_seconds
+
+    missing = missing_settings()
+
+    if warmup and not missing:
+        async with _warmup_lock:
+            if warmup_seconds is None:
+                started = time.perf_counter()
+                await asyncio.to_thread(warm_up)
+                warmup_seconds = round(time.perf_counter() - started, 3)
+
+    if missing:
+        response.status_code = 503
+
+    return ReadyResponse(
+        status="not_ready" if missing else "ready",
+        warm=warmup_seconds is not None,
+        missing_settings=missing,
+        warmup_seconds=warmup_seconds,
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["health"])
+async def metrics():
+    """
+    Prometheus metrics: latency histograms per workflow node and per document,
+    PDF, page content and image sizes, Gemini tokens per call, provider calls
+    and retries, cache and job queue statistics
+    """
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+async def read_pdf_uploads(bills: List[UploadFile]) -> List[Tuple[str, PdfSource]]:
+    """Validate the uploads and spool them to disk, return their filenames and
+    sources. The caller closes the sources once done with them."""
+
+    uploads = []
+    remaining = MAX_REQUEST_BYTES
+
+    try:
+        for bill in bills:
+            # Check if file is a PDF
+            if bill.content_type != "application/pdf":
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File '{bill.filename}' is not a PDF. Received: {bill.content_type}",
+                )
+
+            # Validate the PDF magic number (most reliable) on the first chunk
+            try:
+                pdf = await spool_upload(bill.read, min(MAX_UPLOAD_BYTES, remaining))
+            except NotAPdf:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File '{bill.filename}' is not a valid PDF file",
+                )
+            except PdfTooLarge:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File '{bill.filename}' is over the limit of "
+                    f"{MAX_UPLOAD_BYTES} bytes per file and {MAX_REQUEST_BYTES} per request",
+                )
+
+            remaining -= pdf.size
+            uploads.append((bill.filename or "", pdf))
+    except BaseException:
+        close_uploads(uploads)
+        raise
+
+    return uploads
+
+
+def close_uploads(uploads: List[Tuple[str, PdfSource]]):
+    for _, pdf in uploads:
+        pdf.close()
+
+
 @app.post("/extract-bills", response_model=ExtractResponse, tags=["extraction"])
 async def extract_batch(
+    response: Response,
     bills: List[UploadFile] = File(
         ...,
         description="One or more PDF files containing water bills",
@@ -115,6 +277,22 @@ async def extract_batch(
         description="Processing mode: 'single' for individual extraction, 'merged' for combined results",
         example="single",
     ),
+    concurrency: Optional[int] = Query(
+        None,
+        ge=1,
+        le=32,
+        description="Maximum number of files of this request processed at the same time",
+        example=4,
+    ),
+    images: Literal["inline", "ref", "none"] = Query(
+        "inline",
+        description="'inline' embeds base64 page images, 'ref' returns image URLs, 'none' skips images",
+        example="ref",
+    ),
+    debug: bool = Query(
+        False,
+        description="Report the time spent per workflow node and the tokens used in response headers",
+    ),
 ):
     """
     Extract structured data from water bill PDFs
@@ -128,27 +306,50 @@ async def extract_batch(
     
     **Processing Modes:**
     - `single` (default): Process each bill individually and return separate results
-    - `merged`: Combine all bill data into a single aggregated result
+    - `merged`: Combine the bills of every file into one account history:
+      duplicate bills (same bill number and reading dates) are dropped, bills
+      are sorted by reading period, and `merged` reports gaps and overlaps
+      between consecutive periods with monthly and yearly totals
+    
+    **Images:**
+    - `inline` (default): Each bill carries its page image in base64
+    - `ref`: Each bill carries an `image_url` to `/bills/{doc_id}/pages/{n}.{fmt}`,
+      the page is rendered on first request
+    - `none`: No images are rendered or returned
+    
+    **Debug:**
+    - With `debug=true` the response carries a `Server-Timing` header with the
+      time spent per workflow node, summed over the files, and an
+      `X-Bill-Tokens` header with the prompt and output tokens used, and the
+      estimated tokens of the page content before and after compaction
     
     **Supported File Types:**
     - PDF files only (validated by content type and file headers)
     - Files must contain readable text content
+    - Uploads are spooled to disk, up to MAX_UPLOAD_BYTES per file and
+      MAX_REQUEST_BYTES per request
     
     **Performance:**
     - Files processed concurrently for optimal speed
-    - Maximum concurrent workers equal to number of files
+    - At most `concurrency` files of the request in flight (defaults to REQUEST_CONCURRENCY)
+    - Results keep the upload order, a file that fails is reported in `errors`
+      without failing the rest of the batch
     - Automatic PDF validation and error handling
     
     Args:
         bills: List of PDF files to process (required)
         mode: Processing mode - 'single' or 'merged' (optional, defaults to individual processing)
+        concurrency: Maximum number of files processed at the same time (optional)
+        images: How page images are returned - 'inline', 'ref' or 'none' (optional)
+        debug: Add per request timing and token headers (optional)
     
     Returns:
         ExtractResponse: Structured data including customer address and bill details
     
     Raises:
         HTTPException 400: Invalid file type, corrupted PDF, or validation failure
-        HTTPException 500: Internal processing error during extraction
+        HTTPException 413: File or request over MAX_UPLOAD_BYTES or MAX_REQUEST_BYTES
+        HTTPException 500: Internal processing error, when every file of the batch failed
     
     Example Usage:
         ```bash
@@ -183,38 +384,223 @@ async def extract_batch(
         }
         ```
     """
+    uploads = await read_pdf_uploads(bills)
+
+    try:
+        return await extract_uploads(uploads, response, mode, concurrency, images, debug)
+    finally:
+        close_uploads(uploads)
+
+
+async def extract_uploads(
+    uploads: List[Tuple[str, PdfSource]],
+    response: Response,
+    mode: Optional[Literal["merged", "single"]],
+    concurrency: Optional[int],
+    images: ImageMode,
+    debug: bool,
+) -> ExtractResponse:
+    breakdown = {} if debug else None
+    request_breakdown.set(breakdown)
+
+    request_slots = asyncio.Semaphore(concurrency or REQUEST_CONCURRENCY)
+
+    async def process(filename: str, pdf: PdfSource):
+        async with request_slots:
+            return await aprocess_bill_pdf(pdf, filename, images)
+
+    results = await asyncio.gather(
+        *(process(filename, pdf) for filename, pdf in uploads),
+        return_exceptions=True,
+    )
+
     all_bills = []
+    errors = []
     address = None
 
-    for bill in bills:
-        # Check if file is a PDF
-        if bill.content_type != "application/pdf":
-            raise HTTPException(
-                status_code=400,
-                detail=f"File '{bill.filename}' is not a PDF. Received: {bill.content_type}",
-            )
-
-        # Read and validate PDF magic number (most reliable)
-        content = await bill.read()
-        if not content.startswith(b"%PDF"):
-            raise HTTPException(
-                status_code=400,
-                detail=f"File '{bill.filename}' is not a valid PDF file",
-            )
-
-        # Reset file pointer for further processing
-        await bill.seek(0)
-
-        content = await bill.read()
-
-        address, result = process_bill_pdf(content, bill.filename or "")
-            
+    # gather keeps the upload order
+    for (filename, _), result in zip(uploads, results):
+        if isinstance(result, BaseException):
+            logger.error("Failed to process '%s'", filename, exc_info=result)
+            errors.append(FileError(file_name=filename, detail=str(result)))
+            continue
+
+        file_address, file_bills = result
+        address = file_address or address
+
         # Add bills to the list
-        all_bills.extend(result)
+        all_bills.extend(file_bills)
+
+    if uploads and len(errors) == len(uploads):
+        raise HTTPException(
+            status_code=500,
+            detail=[error.model_dump() for error in errors],
+        )
 
-            
+    if breakdown is not None:
+        response.headers["Server-Timing"] = server_timing(breakdown)
+        response.headers["X-Bill-Tokens"] = (
+            f"prompt={breakdown.get('prompt_tokens', 0)}, "
+            f"output={breakdown.get('output_tokens', 0)}, "
+            f"content_raw={breakdown.get('content_raw_tokens', 0)}, "
+            f"content_compacted={breakdown.get('content_compacted_tokens', 0)}"
+        )
+
+    merged = None
+
+    if mode == "merged":
+        # pandas is only imported by the requests that need it
+        from merge import merge_bills
+
+        all_bills, merged = merge_bills(all_bills)
 
     return ExtractResponse(
         address=address or "Address not found",
-        bills=all_bills
+        bills=all_bills,
+        errors=errors,
+        merged=merged,
     )
+
+
+@app.get(
+    "/bills/{doc_id}/pages/{page_no}.{fmt}",
+    tags=["extraction"],
+    responses={200: {"content": {"image/png": {}, "image/jpeg": {}, "image/webp": {}}}},
+)
+async def bill_page_image(
+    doc_id: str, page_no: int, fmt: Literal["png", "jpeg", "jpg", "webp"], request: Request
+):
+    """
+    Serve the image of one page of a processed PDF
+
+    Image URLs are returned by `/extract-bills?images=ref`. The page is rendered
+    the first time it is requested and served from the blob store afterwards.
+    Images never change for a given document id, so responses can be cached
+    indefinitely.
+
+    Args:
+        doc_id: SHA-256 of the PDF, as found in the bill `image_url`
+        page_no: Zero based page number
+        fmt: Image format - 'png', 'jpeg' or 'webp'
+
+    Raises:
+        HTTPException 404: Unknown document or page
+    """
+    fmt = "jpeg" if fmt == "jpg" else fmt
+
+    if not DOC_ID_PATTERN.match(doc_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    etag = f'"{doc_id[:16]}-{page_no}-{fmt}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+
+    # The document may have been evicted from the blob store since the client
+    # cached the image, a 304 is only sent for pages that still exist
+    if request.headers.get("if-none-match") == etag:
+        if not await asyncio.to_thread(has_page, doc_id, page_no, fmt):
+            raise HTTPException(status_code=404, detail="Page not found")
+
+        return Response(status_code=304, headers=headers)
+
+    image = await aget_page_image(doc_id, page_no, fmt)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Page not found")
+
+    return Response(content=image, media_type=f"image/{fmt}", headers=headers)
+
+
+@app.post("/jobs", response_model=JobCreated, status_code=202, tags=["jobs"])
+async def create_job(
+    bills: List[UploadFile] = File(
+        ...,
+        description="One or more PDF files containing water bills",
+    ),
+    images: Literal["inline", "ref", "none"] = Query(
+        "ref",
+        description="'inline' embeds base64 page images, 'ref' returns image URLs, 'none' skips images",
+    ),
+):
+    """
+    Submit PDF water bills for asynchronous extraction
+
+    Returns immediately with a job id. Files are processed by a pool of
+    background workers; poll `/jobs/{job_id}` for progress or read
+    `/jobs/{job_id}/stream` to receive bills as soon as each file completes.
+    Images default to `ref` to keep job results small.
+
+    Raises:
+        HTTPException 400: Invalid file type or corrupted PDF
+        HTTPException 413: File or request over MAX_UPLOAD_BYTES or MAX_REQUEST_BYTES
+        HTTPException 503: The job queue is full, retry later
+    """
+    uploads = await read_pdf_uploads(bills)
+
+    try:
+        job = job_manager.submit(uploads, images)
+    except QueueFull:
+        close_uploads(uploads)
+        raise HTTPException(
+            status_code=503,
+            detail="Too many files queued, retry later",
+            headers={"Retry-After": "30"},
+        )
+
+    return JobCreated(
+        job_id=job.job_id,
+        status_url=f"/jobs/{job.job_id}",
+        stream_url=f"/jobs/{job.job_id}/stream",
+    )
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatus, tags=["jobs"])
+async def job_status(job_id: str):
+    """
+    Report the progress of a job
+
+    Each file lists its status, the workflow nodes it completed so far and,
+    once done, its address and bills.
+
+    Raises:
+        HTTPException 404: Unknown or expired job
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job.status()
+
+
+@app.get("/jobs/{job_id}/stream", tags=["jobs"])
+async def job_stream(
+    job_id: str,
+    format: Literal["ndjson", "sse"] = Query(
+        "ndjson", description="'ndjson' for JSON lines, 'sse' for server-sent events"
+    ),
+):
+    """
+    Stream the results of a job as files complete
+
+    Emits a `bill` event for every extracted bill, an `error` event for every
+    failed file and a final `done` event. Events already emitted are replayed
+    first, so the stream can be opened at any time while the job is known.
+
+    Raises:
+        HTTPException 404: Unknown or expired job
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for event, data in job.follow():
+            if format == "sse":
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            else:
+                yield json.dumps({"event": event, "data": data}) + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+
+    return StreamingResponse(events(), media_type=media_type)
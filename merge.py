@@ -0,0 +1,177 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from api_entites import BillData, DateInfo, MergedSummary, PeriodIssue, PeriodTotal
+
+COLUMNS = [
+    "bill_no",
+    "file_name",
+    "start_year",
+    "start_month",
+    "start_day",
+    "end_year",
+    "end_month",
+    "end_day",
+    "usage",
+    "water",
+    "sewage",
+    "bill_amount",
+    "problems",
+]
+
+
+def to_frame(bills: List[BillData]) -> pd.DataFrame:
+    """One row per bill, with the reading dates as datetime columns. Dates
+    that do not exist, like February 30, become NaT."""
+
+    frame = pd.DataFrame.from_records(
+        [
+            (
+                bill.bill_no,
+                bill.file_name,
+                bill.start_date.year,
+                bill.start_date.month,
+                bill.start_date.day,
+                bill.end_date.year,
+                bill.end_date.month,
+                bill.end_date.day,
+                bill.usage,
+                bill.water,
+                bill.sewage,
+                bill.bill_amount,
+                len(bill.problems),
+            )
+            for bill in bills
+        ],
+        columns=COLUMNS,
+    )
+    frame["sewage"] = frame["sewage"].astype(float)
+    frame["position"] = np.arange(len(frame))
+
+    for side in ("start", "end"):
+        parts = frame[[f"{side}_year", f"{side}_month", f"{side}_day"]]
+        frame[side] = pd.to_datetime(
+            parts.set_axis(["year", "month", "day"], axis=1), errors="coerce"
+        )
+
+    return frame
+
+
+def to_date_info(timestamp: pd.Timestamp) -> DateInfo:
+    return DateInfo(day=timestamp.day, month=timestamp.month, year=timestamp.year)
+
+
+def period_issues(ordered: pd.DataFrame) -> List[PeriodIssue]:
+    """Compare each bill with the previous bill of the same bill number.
+
+    Consecutive readings usually share a date, or the next period starts the
+    day after, so only more than a day between the previous end and the next
+    start is a gap, and a start before the previous end an overlap.
+    """
+
+    dated = ordered[ordered["start"].notna() & ordered["end"].notna()]
+    grouped = dated.groupby("bill_no", sort=False)
+    previous_end = grouped["end"].shift()
+    previous_file = grouped["file_name"].shift()
+    delta = (dated["start"] - previous_end).dt.days
+
+    one_day = pd.Timedelta(days=1)
+    gaps = delta > 1
+    overlaps = delta < 0
+
+    issues = [
+        PeriodIssue(
+            kind="gap",
+            start=to_date_info(end + one_day),
+            end=to_date_info(start - one_day),
+            days=int(days) - 1,
+            previous_file=previous,
+            file_name=file_name,
+        )
+        for start, end, days, previous, file_name in zip(
+            dated["start"][gaps],
+            previous_end[gaps],
+            delta[gaps],
+            previous_file[gaps],
+            dated["file_name"][gaps],
+        )
+    ] + [
+        PeriodIssue(
+            kind="overlap",
+            start=to_date_info(start + one_day),
+            end=to_date_info(end),
+            days=-int(days),
+            previous_file=previous,
+            file_name=file_name,
+        )
+        for start, end, days, previous, file_name in zip(
+            dated["start"][overlaps],
+            previous_end[overlaps],
+            delta[overlaps],
+            previous_file[overlaps],
+            dated["file_name"][overlaps],
+        )
+    ]
+
+    return sorted(issues, key=lambda issue: (issue.start.year, issue.start.month, issue.start.day))
+
+
+def period_totals(dated: pd.DataFrame, freq: str) -> List[PeriodTotal]:
+    """Sum the bills by the month ("M") or year ("Y") of their current reading"""
+
+    totals = (
+        dated.groupby(dated["end"].dt.to_period(freq))
+        .agg(
+            bills=("usage", "size"),
+            usage=("usage", "sum"),
+            water=("water", "sum"),
+            sewage=("sewage", "sum"),
+            bill_amount=("bill_amount", "sum"),
+        )
+        .round(2)
+    )
+
+    return [
+        PeriodTotal(period=str(period), **row)
+        for period, row in zip(totals.index, totals.to_dict("records"))
+    ]
+
+
+def merge_bills(bills: List[BillData]) -> Tuple[List[BillData], MergedSummary]:
+    """Merge the bills of every file of a batch into one account history.
+
+    Bills sharing a bill number and reading dates are copies of the same bill,
+    from overlapping statements or the same file uploaded twice, and only the
+    copy with the fewest validation problems is kept. The rest are sorted by
+    reading period, bills with invalid dates last.
+    """
+
+    if not bills:
+        return [], MergedSummary(bills=0, duplicates=0)
+
+    frame = to_frame(bills)
+
+    deduplicated = frame.sort_values(["problems", "position"], kind="stable").drop_duplicates(
+        ["bill_no", *COLUMNS[2:8]]
+    )
+    ordered = deduplicated.sort_values(
+        ["start", "end", "position"], na_position="last", kind="stable"
+    )
+
+    dated = ordered[ordered["end"].notna()]
+    start: Optional[pd.Timestamp] = ordered["start"].min()
+    end: Optional[pd.Timestamp] = ordered["end"].max()
+
+    summary = MergedSummary(
+        bills=len(ordered),
+        duplicates=len(frame) - len(ordered),
+        start=None if pd.isna(start) else to_date_info(start),
+        end=None if pd.isna(end) else to_date_info(end),
+        issues=period_issues(ordered),
+        monthly=period_totals(dated, "M"),
+        yearly=period_totals(dated, "Y"),
+    )
+
+    return [bills[position] for position in ordered["position"]], summary
@@ -0,0 +1,222 @@
+import threading
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Callable, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4**exponent for exponent in range(11))  # 1 KiB to 1 GiB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+# Provider batches take minutes to hours, up to a day
+BATCH_BUCKETS = (10, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+# A sample is (labels, value), a family is (name, help, type, samples)
+Sample = Tuple[dict, float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    return (
+        "{"
+        + ",".join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+        + "}"
+    )
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] += amount
+
+    def collect(self) -> Family:
+        with self._lock:
+            samples = [(dict(key), value) for key, value in self._values.items()]
+
+        return self.name, self.help, "counter", samples
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Iterable[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts: dict[tuple, List[int]] = {}
+        self._sums: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self._sums[key] += value
+
+    def collect(self) -> Family:
+        samples = []
+
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(({**labels, "le": format_value(bound)}, count))
+                samples.append(({**labels, "le": "+Inf"}, counts[-1]))
+                samples.append(({**labels, "__suffix__": "_sum"}, self._sums[key]))
+                samples.append(({**labels, "__suffix__": "_count"}, counts[-1]))
+
+        return self.name, self.help, "histogram", samples
+
+
+class Registry:
+    """Metrics rendered in the Prometheus text exposition format.
+
+    Collectors are callables returning families computed at scrape time, for
+    state owned by other components (cache, governor, job queue...).
+    """
+
+    def __init__(self):
+        self.metrics: List = []
+        self.collectors: List[Callable[[], List[Family]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float]) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[Family]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        families = [metric.collect() for metric in self.metrics]
+        for collector in self.collectors:
+            families.extend(collector())
+
+        lines = []
+
+        for name, help, kind, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for labels, value in samples:
+                labels = dict(labels)
+                suffix = labels.pop("__suffix__", "_bucket" if "le" in labels else "")
+                lines.append(
+                    f"{name}{suffix}{format_labels(labels)} {format_value(value)}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+NODE_DURATION = registry.histogram(
+    "bill_parser_node_duration_seconds",
+    "Wall time of each workflow node",
+    LATENCY_BUCKETS,
+)
+DOCUMENT_DURATION = registry.histogram(
+    "bill_parser_document_duration_seconds",
+    "Wall time of a whole document through the workflow",
+    LATENCY_BUCKETS,
+)
+PDF_BYTES = registry.histogram(
+    "bill_parser_pdf_bytes", "Size of the processed PDFs", SIZE_BUCKETS
+)
+CONTENT_CHARS = registry.histogram(
+    "bill_parser_page_content_chars",
+    "Characters of page content per document, by source (text_layer, page_cache or ocr)",
+    SIZE_BUCKETS,
+)
+CONTENT_TOKENS = registry.histogram(
+    "bill_parser_content_tokens",
+    "Estimated tokens of page content per document, before (raw) and after (compacted) compaction",
+    TOKEN_BUCKETS,
+)
+PAGES = registry.counter(
+    "bill_parser_pages_total", "Pages read, by source (text_layer, page_cache or ocr)"
+)
+OCR_CHUNKS = registry.counter(
+    "bill_parser_ocr_chunks_total",
+    "OCR calls by outcome (ok, retried or failed), a document of many pages is OCR'd in chunks",
+)
+LLM_CALL_DURATION = registry.histogram(
+    "bill_parser_llm_call_duration_seconds",
+    "Latency of Gemini calls, by node and model",
+    LATENCY_BUCKETS,
+)
+LLM_TOKENS = registry.histogram(
+    "bill_parser_llm_tokens",
+    "Tokens per Gemini call, by model and kind (prompt or output)",
+    TOKEN_BUCKETS,
+)
+LLM_ROUTES = registry.counter(
+    "bill_parser_llm_routes_total",
+    "Routed Gemini calls, by node, model, thinking budget and routing reason",
+)
+BATCH_REQUESTS = registry.counter(
+    "bill_parser_batch_requests_total",
+    "Gemini calls sent in provider batches, by backend and outcome (ok or failed)",
+)
+BATCH_DURATION = registry.histogram(
+    "bill_parser_batch_duration_seconds",
+    "Time from the submission of a batch to its results, by backend and model",
+    BATCH_BUCKETS,
+)
+EXTRACTIONS = registry.counter(
+    "bill_parser_extractions_total",
+    "Documents by extraction path (rules or llm), layout and rule outcome",
+)
+BILL_VALIDATIONS = registry.counter(
+    "bill_parser_bill_validations_total",
+    "LLM extracted bills by validation outcome (valid, invalid, then repaired or unrepaired after the retry)",
+)
+IMAGE_BYTES = registry.histogram(
+    "bill_parser_page_image_bytes", "Size of the rendered page images", SIZE_BUCKETS
+)
+
+# Per request breakdown, set by the API when a client asks for it. Nodes run
+# in tasks copied from the request context, so they all add to the same dict.
+request_breakdown: ContextVar[Optional[dict]] = ContextVar(
+    "request_breakdown", default=None
+)
+
+
+def add_to_breakdown(key: str, value: float):
+    breakdown = request_breakdown.get()
+
+    if breakdown is not None:
+        breakdown[key] = breakdown.get(key, 0) + value
+
+
+def server_timing(breakdown: dict) -> str:
+    """Format a breakdown of seconds as a Server-Timing header value"""
+
+    return ", ".join(
+        f"{key};dur={value * 1000:.1f}"
+        for key, value in breakdown.items()
+        if not key.endswith("_tokens")
+    )
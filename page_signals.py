@@ -0,0 +1,101 @@
+import re
+from typing import List
+
+MONTHS = "jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec"
+
+DATE_PATTERN = re.compile(
+    r"\b\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}\b"  # 07/31/2022, 31-07-22
+    r"|\b\d{4}-\d{2}-\d{2}\b"  # 2022-07-31
+    rf"|\b(?:{MONTHS})[a-z]*\.?\s*\d{{1,2}}(?:,\s*|/)\d{{2,4}}\b"  # Aug 18, 2022, Aug 18/22
+    rf"|\b\d{{1,2}}\s+(?:{MONTHS})[a-z]*\.?\s+\d{{4}}\b",  # 18 August 2022
+    re.IGNORECASE,
+)
+AMOUNT_PATTERN = re.compile(r"[$€£]\s?\d[\d,]*\.\d{2}\b|\b\d[\d,]*\.\d{2}\s?[$€£]")
+VOLUME_PATTERN = re.compile(r"\bm3\b|m³|cubic met", re.IGNORECASE)
+KEYWORD_PATTERN = re.compile(
+    r"\b(?:water|sewage|sewer|total|consumption|reading|meter|usage|due)\b",
+    re.IGNORECASE,
+)
+
+
+def page_signals(text: str) -> dict[str, int]:
+    """Count the bill signals found in the text of one page"""
+
+    return {
+        "dates": len(DATE_PATTERN.findall(text)),
+        "amounts": len(AMOUNT_PATTERN.findall(text)),
+        "volumes": len(VOLUME_PATTERN.findall(text)),
+        "keywords": len(KEYWORD_PATTERN.findall(text)),
+    }
+
+
+def is_bill_page(text: str) -> bool:
+    """A page can hold a bill when it has a reading period (two dates), an
+    amount and at least one water billing keyword."""
+
+    signals = page_signals(text)
+
+    return signals["dates"] >= 2 and signals["amounts"] >= 1 and signals["keywords"] >= 1
+
+
+def bill_pages(pages: dict[int, str]) -> List[int]:
+    return [page_no for page_no in sorted(pages) if is_bill_page(pages[page_no])]
+
+
+def relevance_score(text: str) -> float:
+    """Rank pages by how much bill data they carry. Terms and conditions, ads
+    and remittance stubs have no reading dates or amounts and score zero."""
+
+    signals = page_signals(text)
+
+    if not signals["dates"] and not signals["amounts"]:
+        return 0.0
+
+    return (
+        2 * min(signals["dates"], 6)
+        + 2 * min(signals["amounts"], 10)
+        + 3 * min(signals["volumes"], 3)
+        + min(signals["keywords"], 10)
+    )
+
+
+def estimate_tokens(text: str) -> int:
+    # Close enough to Gemini's tokenizer for budgeting, about 4 chars per token
+    return len(text) // 4 + 1
+
+
+def select_relevant_pages(pages: dict[int, str], token_budget: int) -> List[int]:
+    """Pick the pages worth sending to the model, in page order.
+
+    The first page is always kept since it carries the address and account
+    header, bill pages are kept next, then any other page with dates or
+    amounts by descending score, as long as the total stays under the budget.
+    """
+
+    if not pages:
+        return []
+
+    first_page = min(pages)
+    bill_page_nos = set(bill_pages(pages))
+    scores = {page_no: relevance_score(text) for page_no, text in pages.items()}
+
+    ranked = sorted(
+        (page_no for page_no in pages if page_no != first_page),
+        key=lambda page_no: (page_no not in bill_page_nos, -scores[page_no], page_no),
+    )
+
+    selected = [first_page]
+    used = estimate_tokens(pages[first_page])
+
+    for page_no in ranked:
+        if not scores[page_no]:
+            break
+
+        tokens = estimate_tokens(pages[page_no])
+        if used + tokens > token_budget:
+            continue
+
+        selected.append(page_no)
+        used += tokens
+
+    return sorted(selected)
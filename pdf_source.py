@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterator, Optional, Union
+
+if TYPE_CHECKING:
+    import fitz
+
+# Directory uploads are spooled to, the system temporary directory by default
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or None
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+class NotAPdf(Exception):
+    pass
+
+
+class PdfTooLarge(Exception):
+    pass
+
+
+class PdfSource:
+    """A PDF handed through the workflow without holding it in memory.
+
+    File backed sources are opened by path and memory-mapped when their bytes
+    are needed, and pickle as their path, so render workers open the file
+    themselves instead of receiving a copy. Sources built from bytes keep
+    working for callers that already have the document in memory.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        data: Optional[bytes] = None,
+        owned: bool = False,
+        digest: Optional[str] = None,
+    ):
+        self.path = path
+        self.data = data
+        self.owned = owned
+        self._digest = digest
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PdfSource":
+        return cls(data=data)
+
+    @classmethod
+    def from_file(cls, path: str) -> "PdfSource":
+        return cls(path=path)
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else os.path.getsize(self.path)
+
+    @contextmanager
+    def view(self) -> Iterator[Union[bytes, mmap.mmap]]:
+        """Bytes-like view of the whole document, mapped rather than read"""
+
+        if self.data is not None or not self.size:
+            yield self.data or b""
+            return
+
+        with open(self.path, "rb") as pdf, mmap.mmap(
+            pdf.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            yield mapped
+
+    def open(self) -> "fitz.Document":
+        # PyMuPDF is imported on first use, it adds a few hundred ms to start up
+        import fitz  # PyMuPDF - pip install PyMuPDF
+
+        if self.data is not None:
+            return fitz.open(stream=self.data, filetype="pdf")
+
+        return fitz.open(self.path, filetype="pdf")
+
+    def read(self) -> bytes:
+        with self.view() as view:
+            return bytes(view)
+
+    def sha256(self) -> str:
+        if self._digest is None:
+            with self.view() as view:
+                self._digest = hashlib.sha256(view).hexdigest()
+
+        return self._digest
+
+    def share(self) -> "PdfSource":
+        """Source of the same document for work that may outlive this one.
+
+        A spooled upload is hard linked to a spool file of its own, deleted
+        when the returned source is closed, so closing the upload does not
+        pull the document from under the work. Other sources are not deleted
+        on close and are returned as they are.
+        """
+
+        if not (self.owned and self.path):
+            return self
+
+        directory, name = os.path.split(self.path)
+        path = os.path.join(directory, f"{uuid.uuid4().hex[:12]}-{name}")
+
+        try:
+            os.link(self.path, path)
+        except OSError:
+            # Filesystems without hard links get a copy
+            shutil.copyfile(self.path, path)
+
+        return PdfSource(path=path, owned=True, digest=self._digest)
+
+    def close(self):
+        """Delete the spooled file of an upload, no-op for other sources"""
+
+        if self.owned and self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def as_pdf_source(pdf: Union[bytes, PdfSource]) -> PdfSource:
+    return pdf if isinstance(pdf, PdfSource) else PdfSource.from_bytes(pdf)
+
+
+async def spool_upload(
+    read: Callable[[int], Awaitable[bytes]], max_bytes: int
+) -> PdfSource:
+    """Copy an upload to a temporary file chunk by chunk, hashing it on the
+    way. The %PDF header is checked on the first chunk and the copy stops as
+    soon as the upload grows over ``max_bytes``."""
+
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=UPLOAD_SPOOL_DIR)
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            while chunk := await read(SPOOL_CHUNK_SIZE):
+                if not size and not chunk.startswith(b"%PDF"):
+                    raise NotAPdf()
+
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PdfTooLarge()
+
+                digest.update(chunk)
+                await asyncio.to_thread(spool.write, chunk)
+
+        if not size:
+            raise NotAPdf()
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    return PdfSource(path=path, owned=True, digest=digest.hexdigest())
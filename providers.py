@@ -0,0 +1,60 @@
+import importlib
+import os
+from functools import cache
+from types import ModuleType
+
+# Importing mistralai and google-genai costs about a second of start up, they
+# are only imported once a provider is actually called, or by warm_up()
+
+
+class LazyModule:
+    """Stands in for a module that is imported on first attribute access"""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def load(self) -> ModuleType:
+        return importlib.import_module(self._name)
+
+
+genai_types = LazyModule("google.genai.types")
+mistral_models = LazyModule("mistralai.models")
+
+
+def missing_settings() -> list[str]:
+    """Environment variables the provider clients need and are not set"""
+
+    missing = []
+
+    if not os.environ.get("MISTRAL_API_KEY"):
+        missing.append("MISTRAL_API_KEY")
+
+    if not (
+        os.environ.get("GOOGLE_API_KEY")
+        or os.environ.get("GEMINI_API_KEY")
+        or os.environ.get("GOOGLE_GENAI_USE_VERTEXAI", "").lower() in ("1", "true")
+    ):
+        missing.append("GOOGLE_API_KEY")
+
+    return missing
+
+
+@cache
+def mistral_client():
+    from mistralai import Mistral
+
+    api_key = os.environ.get("MISTRAL_API_KEY")
+    if not api_key:
+        raise RuntimeError("MISTRAL_API_KEY is not set")
+
+    return Mistral(api_key=api_key)
+
+
+@cache
+def google_client():
+    from google import genai
+
+    return genai.Client()
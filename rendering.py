@@ -0,0 +1,151 @@
+import asyncio
+import base64
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from metrics import IMAGE_BYTES
+from pdf_source import PdfSource
+from stages import stage
+
+if TYPE_CHECKING:
+    import fitz
+
+
+class RenderOptions(BaseModel):
+    format: Literal["png", "jpeg", "webp"] = Field(
+        "png", description="Image format of the rendered pages"
+    )
+    scale: float = Field(2.0, description="Zoom factor applied to the PDF page size")
+    quality: int = Field(80, description="Quality of lossy formats, from 1 to 100")
+    thumbnail: int = Field(
+        0, description="Longest side of the image in pixels, 0 for full size pages"
+    )
+
+
+DEFAULT_RENDER_OPTIONS = RenderOptions(
+    format=os.environ.get("PAGE_IMAGE_FORMAT", "png"),
+    scale=float(os.environ.get("PAGE_IMAGE_SCALE", "2")),
+    quality=int(os.environ.get("PAGE_IMAGE_QUALITY", "80")),
+    thumbnail=int(os.environ.get("PAGE_IMAGE_THUMBNAIL", "0")),
+)
+
+RENDER_PROCESSES = int(os.environ.get("RENDER_PROCESSES", str(os.cpu_count() or 1)))
+
+# Pages of one document rendered by a single worker task, larger documents are
+# split over several workers
+RENDER_PAGES_PER_TASK = int(os.environ.get("RENDER_PAGES_PER_TASK", "4"))
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+
+# Render tasks queue here rather than in the executor, which keeps the queue
+# depth and utilization of the pool visible
+render_stage = stage("render", RENDER_PROCESSES)
+
+
+def render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+
+    if _render_pool is None:
+        # Forking a process that already runs threads (the server, to_thread
+        # workers, SDK clients) can deadlock the child, workers are spawned
+        _render_pool = ProcessPoolExecutor(
+            max_workers=RENDER_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+
+    if _render_pool is not None:
+        _render_pool.shutdown()
+        _render_pool = None
+
+
+def encode_pixmap(pix: "fitz.Pixmap", options: RenderOptions) -> bytes:
+    if options.format == "png":
+        return pix.tobytes("png")
+
+    if options.format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=options.quality)
+
+    # PyMuPDF has no WebP writer, hand the raw samples to PIL
+    from PIL import Image
+
+    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    buffered = io.BytesIO()
+    image.save(buffered, format="WEBP", quality=options.quality)
+
+    return buffered.getvalue()
+
+
+def render_pages(
+    pdf: PdfSource, page_nos: List[int], options: RenderOptions
+) -> dict[int, str]:
+    """Render each page once, straight from the pixmap to the target format,
+    and return the images base64 encoded by page number. Pages outside the
+    document are skipped."""
+
+    import fitz  # PyMuPDF - pip install PyMuPDF
+
+    pdf_document = pdf.open()
+    images = {}
+
+    for page_num in sorted(set(page_nos)):
+        if not 0 <= page_num < len(pdf_document):
+            continue
+
+        page = pdf_document[page_num]
+        zoom = options.scale
+
+        if options.thumbnail:
+            zoom = min(zoom, options.thumbnail / max(page.rect.width, page.rect.height))
+
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        images[page_num] = base64.b64encode(encode_pixmap(pix, options)).decode("utf-8")
+
+    pdf_document.close()
+
+    return images
+
+
+async def arender_pages(
+    pdf: PdfSource, page_nos: List[int], options: Optional[RenderOptions] = None
+) -> dict[int, str]:
+    """Render pages on the process pool, off the event loop and the GIL. File
+    backed sources are sent to the workers as a path, not as bytes."""
+
+    options = options or DEFAULT_RENDER_OPTIONS
+    page_nos = sorted(set(page_nos))
+
+    if not page_nos:
+        return {}
+
+    loop = asyncio.get_running_loop()
+    chunks = [
+        page_nos[start : start + RENDER_PAGES_PER_TASK]
+        for start in range(0, len(page_nos), RENDER_PAGES_PER_TASK)
+    ]
+
+    async def render_chunk(chunk: List[int]) -> dict[int, str]:
+        async with render_stage.slot():
+            return await loop.run_in_executor(
+                render_pool(), render_pages, pdf, chunk, options
+            )
+
+    results = await asyncio.gather(*(render_chunk(chunk) for chunk in chunks))
+
+    images = {
+        page_num: image for chunk in results for page_num, image in chunk.items()
+    }
+
+    for image in images.values():
+        IMAGE_BYTES.observe(len(image) * 3 // 4, format=options.format)
+
+    return images
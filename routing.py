@@ -0,0 +1,90 @@
+import os
+import re
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from page_signals import DATE_PATTERN, estimate_tokens
+
+LITE_MODEL = os.environ.get("ROUTE_LITE_MODEL", "gemini-2.5-flash-lite")
+
+# Content within all of these limits is easy and routed down to the lite
+# model without thinking. Content over any of them stays on the model of its
+# node, with ROUTE_THINKING_BUDGET tokens.
+EASY_MAX_TOKENS = int(os.environ.get("ROUTE_EASY_MAX_TOKENS", "6000"))
+EASY_MAX_DATE_PAIRS = int(os.environ.get("ROUTE_EASY_MAX_DATE_PAIRS", "4"))
+EASY_MAX_TABLE_DENSITY = float(os.environ.get("ROUTE_EASY_MAX_TABLE_DENSITY", "0.6"))
+THINKING_BUDGET = int(os.environ.get("ROUTE_THINKING_BUDGET", "1024"))
+
+# Thinking budget of the larger model bills failing validation escalate to
+ESCALATION_THINKING_BUDGET = int(
+    os.environ.get("ROUTE_ESCALATION_THINKING_BUDGET", "2048")
+)
+
+# Markdown table rows, and text layer lines with columns kept apart by runs
+# of spaces
+TABLE_LINE = re.compile(r"\|.*\||\S {2,}\S")
+
+
+class Route(BaseModel):
+    model: str
+    # None leaves thinking to the model default
+    thinking_budget: Optional[int] = None
+    # Why the route was taken: "easy", the features over their limit,
+    # "validation" for escalations, "pinned" for models set by the operator
+    # or "fixed" when routing is off
+    reason: str
+    features: dict[str, float] = Field(default_factory=dict)
+
+
+def content_features(content: str) -> dict[str, float]:
+    """Cheap signals of how hard the content is to read"""
+
+    lines = [line for line in content.splitlines() if line.strip()]
+    table_lines = sum(1 for line in lines if TABLE_LINE.search(line))
+
+    return {
+        "tokens": estimate_tokens(content),
+        "date_pairs": len(DATE_PATTERN.findall(content)) // 2,
+        "table_density": round(table_lines / max(len(lines), 1), 3),
+    }
+
+
+def route(features: dict[str, float], model: str) -> Route:
+    """Route a call of a node configured with ``model``. Easy content goes down
+    to the lite model, the rest stays on ``model``."""
+
+    hard = [
+        name
+        for name, limit in (
+            ("tokens", EASY_MAX_TOKENS),
+            ("date_pairs", EASY_MAX_DATE_PAIRS),
+            ("table_density", EASY_MAX_TABLE_DENSITY),
+        )
+        if features[name] > limit
+    ]
+
+    if not hard:
+        return Route(model=LITE_MODEL, thinking_budget=0, reason="easy", features=features)
+
+    return Route(
+        model=model,
+        thinking_budget=THINKING_BUDGET,
+        reason=",".join(hard),
+        features=features,
+    )
+
+
+def escalate(model: str) -> Route:
+    return Route(
+        model=model, thinking_budget=ESCALATION_THINKING_BUDGET, reason="validation"
+    )
+
+
+def policy() -> str:
+    """Settings of the routing policy, part of the pipeline version"""
+
+    return (
+        f"{LITE_MODEL}:{EASY_MAX_TOKENS}:{EASY_MAX_DATE_PAIRS}:"
+        f"{EASY_MAX_TABLE_DENSITY}:{THINKING_BUDGET}:{ESCALATION_THINKING_BUDGET}"
+    )
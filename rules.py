@@ -0,0 +1,211 @@
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from model_entities import Bill, Date
+
+AMOUNT = r"\$\s?(-?[\d,]+\.\d{2})"
+
+# Separators found between a label and its value, in the PyMuPDF text layer
+# (runs of spaces) as well as in OCR markdown (table pipes, bold markers)
+SEP = r"[\s|*:]*"
+
+# Fields a bill of a layout may not print
+OPTIONAL_FIELDS = {"balance"}
+
+
+class Layout:
+    """Known bill layout of one utility.
+
+    ``anchor`` identifies the utility, ``bill_start`` the first page of each
+    bill of a statement bundle. ``fields`` maps the values read off a bill to
+    patterns tried in order on its pages; the first group of the first match
+    is the value. ``readings`` captures the current and previous reading
+    dates, in ``date_format``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        anchor: str,
+        bill_start: str,
+        readings: str,
+        date_format: str,
+        fields: dict[str, List[str]],
+    ):
+        self.name = name
+        self.anchor = re.compile(anchor, re.IGNORECASE)
+        self.bill_start = re.compile(bill_start, re.IGNORECASE)
+        self.readings = re.compile(readings)
+        self.date_format = date_format
+        self.fields = {
+            field: [re.compile(pattern, re.IGNORECASE | re.MULTILINE) for pattern in patterns]
+            for field, patterns in fields.items()
+        }
+
+
+LAYOUTS = [
+    Layout(
+        name="toronto_water",
+        anchor=r"Toronto Water",
+        bill_start=r"Page 1 of \d",
+        # Meter table row: number, dial, current date and reading, previous
+        # date and reading, consumption
+        readings=r"(\d{2}/\d{2}/\d{4})[\s|]+[\d,.]+[\s|]+(\d{2}/\d{2}/\d{4})",
+        date_format="%m/%d/%Y",
+        fields={
+            "bill_no": [r"Account No\.?:?[^\n]*\n?[\s|*]*(\d{9})(?!\d)"],
+            "consumption": [rf"Total Consumption \(m3\){SEP}([\d,]+\.\d+)"],
+            "water_sewer": [rf"Total Water/Sewer Services - Current Billing{SEP}{AMOUNT}"],
+            # Balance carried over from the previous bill, after payments and
+            # adjustments, part of the total
+            "balance": [rf"^[\s|*]*Balance{SEP}{AMOUNT}"],
+            "total": [rf"^[\s|*]*Total{SEP}{AMOUNT}[\s|*]*$"],
+            "address": [
+                r"Service Address:?[ \t|*]*(\d+ [A-Z][A-Z0-9 .'-]*?)[\s|*]*$",
+                # Value on the next line, in the right hand column
+                r"Service Address:?[^\n]*\n(?:[^\n]*(?:\s{2}|\|))?[\s*]*(\d+ [A-Z][A-Z0-9 .'-]*?)[\s|*]*$",
+            ],
+        },
+    ),
+]
+
+
+def find_layout(pages: dict[int, str]) -> Optional[Layout]:
+    text = "\n".join(pages.values())
+
+    return next((layout for layout in LAYOUTS if layout.anchor.search(text)), None)
+
+
+def split_bills(layout: Layout, pages: dict[int, str]) -> List[List[int]]:
+    """Group the pages of a bundle into bills, a bill runs from its first page
+    to the next one. Pages before the first bill start are dropped."""
+
+    groups: List[List[int]] = []
+
+    for page_no in sorted(pages):
+        if layout.bill_start.search(pages[page_no]):
+            groups.append([])
+        if groups:
+            groups[-1].append(page_no)
+
+    return groups
+
+
+def parse_amount(value: str) -> float:
+    return float(value.replace(",", ""))
+
+
+def parse_date(value: str, date_format: str) -> Date:
+    parsed = datetime.strptime(value, date_format)
+
+    return Date(day=parsed.day, month=parsed.month, year=parsed.year)
+
+
+def search(layout: Layout, field: str, pages: dict[int, str], page_nos: List[int]):
+    """Return the first value of a field in the pages, and its page"""
+
+    for page_no in page_nos:
+        for pattern in layout.fields[field]:
+            match = pattern.search(pages[page_no])
+            if match:
+                return match.group(1).strip(), page_no
+
+    return None, None
+
+
+def extract_bill(
+    layout: Layout, pages: dict[int, str], page_nos: List[int]
+) -> Tuple[Optional[Bill], Optional[str], str]:
+    """Read one bill off its pages. Returns the bill and the address, or None
+    and the reason the rules could not be trusted."""
+
+    values = {
+        field: search(layout, field, pages, page_nos) for field in layout.fields
+    }
+    missing = [
+        field
+        for field, (value, _) in values.items()
+        if value is None and field not in OPTIONAL_FIELDS
+    ]
+
+    readings = {
+        match.groups()
+        for page_no in page_nos
+        for match in layout.readings.finditer(pages[page_no])
+    }
+
+    if len(readings) != 1:
+        missing.append("readings")
+
+    if missing:
+        return None, None, "missing_fields"
+
+    (current, previous), = readings
+    current_date = parse_date(current, layout.date_format)
+    previous_date = parse_date(previous, layout.date_format)
+
+    water_sewer = parse_amount(values["water_sewer"][0])
+    balance = parse_amount(values["balance"][0]) if values["balance"][0] else 0
+    total = parse_amount(values["total"][0])
+
+    # Water and sewer are billed as one charge, the total adds the balance
+    if abs(water_sewer + balance - total) > 0.01:
+        return None, None, "invariant"
+
+    if (current_date.year, current_date.month, current_date.day) <= (
+        previous_date.year,
+        previous_date.month,
+        previous_date.day,
+    ):
+        return None, None, "invariant"
+
+    bill = Bill(
+        page_no=values["total"][1],
+        previous_date=previous_date,
+        current_date=current_date,
+        consumption=parse_amount(values["consumption"][0]),
+        # No separate sewage charge, as read by the LLM for combined billing
+        total_bill=total,
+        sewage=None,
+        bill_no=values["bill_no"][0],
+    )
+
+    return bill, values["address"][0], "ok"
+
+
+def extract_bills(
+    pages: dict[int, str],
+) -> Tuple[Optional[List[Bill]], Optional[str], Optional[str], str]:
+    """Extract every bill of a document from its page text with the rules of
+    a known layout.
+
+    Returns the bills, the address, the layout name and an outcome: "ok", or
+    why the document has to go to the LLM ("no_layout", "missing_fields",
+    "invariant"). Bills are only returned when every bill of the document
+    passed.
+    """
+
+    layout = find_layout(pages)
+
+    if layout is None:
+        return None, None, None, "no_layout"
+
+    groups = split_bills(layout, pages)
+
+    if not groups:
+        return None, None, layout.name, "missing_fields"
+
+    bills = []
+    address = None
+
+    for page_nos in groups:
+        bill, bill_address, outcome = extract_bill(layout, pages, page_nos)
+
+        if bill is None:
+            return None, None, layout.name, outcome
+
+        bills.append(bill)
+        address = address or bill_address
+
+    return bills, address, layout.name, "ok"
@@ -0,0 +1,82 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into a single execution.
+
+    The first caller of a key starts the call as a task, callers arriving
+    while it runs await the same task. The task is shielded, so a caller that
+    goes away, e.g. a client disconnecting, does not cancel the work for the
+    others. Keys are forgotten as soon as their call completes: results are
+    not cached here.
+
+    Progress of the call reaches every caller: events passed to ``notify``
+    go to the listener of each caller still waiting, and callers joining
+    late first get the events they missed.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self._listeners: dict[Hashable, List[Callable[[Any], None]]] = {}
+        self._events: dict[Hashable, List[Any]] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        call: Callable[[], Awaitable[T]],
+        listener: Optional[Callable[[Any], None]] = None,
+    ) -> T:
+        task = self._calls.get(key)
+
+        if task is None:
+            self.calls += 1
+            self._listeners[key] = []
+            self._events[key] = []
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+
+        listeners = self._listeners[key]
+
+        if listener is not None:
+            for event in self._events[key]:
+                listener(event)
+
+            listeners.append(listener)
+
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if listener in listeners:
+                listeners.remove(listener)
+
+    def notify(self, key: Hashable, event: Any):
+        """Pass an event of the running call of key to its callers"""
+
+        if key not in self._events:
+            return
+
+        self._events[key].append(event)
+
+        for listener in list(self._listeners[key]):
+            listener(event)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._listeners[key]
+            del self._events[key]
+
+        # Mark the exception as retrieved when every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Generic, List, TypeVar
+
+from metrics import registry
+
+T = TypeVar("T")
+
+
+class LoopLocal(Generic[T]):
+    """One instance of an asyncio primitive per event loop.
+
+    Semaphores and locks bind to the loop that first waits on them. Module
+    level ones would fail in every later loop, e.g. on the second call of
+    process_bill_pdf, which runs each document in a new loop.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self._instances: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def get(self) -> T:
+        loop = asyncio.get_running_loop()
+        instance = self._instances.get(loop)
+
+        if instance is None:
+            instance = self._instances[loop] = self.factory()
+
+        return instance
+
+
+class Stage:
+    """Bounded pool for one kind of work of the pipeline: OCR calls, LLM calls
+    or page rendering.
+
+    Documents hold a slot of a stage only while they do that kind of work and
+    wait in the stage queue otherwise, so a document waiting for the LLM does
+    not keep another one from being OCR'd. Across a batch the stages overlap,
+    and throughput is bounded by the slowest stage instead of the sum of all.
+    """
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._slots = LoopLocal(lambda: asyncio.Semaphore(capacity))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        queued = time.perf_counter()
+        self.queued += 1
+
+        slots = self._slots.get()
+
+        try:
+            await slots.acquire()
+        finally:
+            self.queued -= 1
+
+        started = time.perf_counter()
+        self.wait_seconds += started - queued
+        self.active += 1
+
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - started
+            slots.release()
+
+
+stages: List[Stage] = []
+
+
+def stage(name: str, capacity: int) -> Stage:
+    pipeline_stage = Stage(name, capacity)
+    stages.append(pipeline_stage)
+
+    return pipeline_stage
+
+
+def collect_stage_metrics():
+    families = [
+        ("capacity", "bill_parser_stage_capacity", "gauge", "Slots"),
+        ("active", "bill_parser_stage_active", "gauge", "Slots in use"),
+        ("queued", "bill_parser_stage_queue_depth", "gauge", "Tasks waiting for a slot"),
+        ("completed", "bill_parser_stage_tasks_total", "counter", "Tasks completed"),
+        (
+            "busy_seconds",
+            "bill_parser_stage_busy_seconds_total",
+            "counter",
+            "Slot time used, divided by capacity the rate is the utilization",
+        ),
+        (
+            "wait_seconds",
+            "bill_parser_stage_queue_wait_seconds_total",
+            "counter",
+            "Time tasks spent waiting for a slot",
+        ),
+    ]
+
+    return [
+        (
+            name,
+            f"{help}, by pipeline stage",
+            kind,
+            [({"stage": stage.name}, getattr(stage, key)) for stage in stages],
+        )
+        for key, name, kind, help in families
+    ] + [
+        (
+            "bill_parser_stage_utilization",
+            "Share of the slots in use, by pipeline stage",
+            "gauge",
+            [({"stage": stage.name}, stage.active / stage.capacity) for stage in stages],
+        )
+    ]
+
+
+registry.register_collector(collect_stage_metrics)
@@ -0,0 +1,5 @@
+import os
+
+# Tests never read or write the persistent caches of the working directory
+os.environ.setdefault("RESULT_CACHE_PATH", "")
+os.environ.setdefault("PAGE_CACHE_PATH", "")
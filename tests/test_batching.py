@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from batching import BatchBackend, BatchError, Batcher, BatchRequest, FileBatchBackend
+
+
+def respond(model: str, request: dict) -> dict:
+    """Stub answering every request with its own id, failing the "fail" ones"""
+
+    if request.get("fail"):
+        raise ValueError(f"cannot answer {request['id']}")
+
+    text = f"{model}:{request['id']}"
+
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def call(batcher: Batcher, model: str, request: dict):
+    return batcher.generate(model, BatchRequest(contents=None, config=None, request=request))
+
+
+def batch_models(root) -> list:
+    """Models of the requests of each batch written under root"""
+
+    models = []
+
+    for batch_id in os.listdir(root):
+        with open(os.path.join(root, batch_id, "requests.jsonl")) as file:
+            models.append(sorted({json.loads(line)["model"] for line in file}))
+
+    return models
+
+
+def test_calls_are_batched_per_model_and_answered_in_request_order(tmp_path):
+    async def run():
+        batcher = Batcher(
+            FileBatchBackend(str(tmp_path), respond=respond, delay=0),
+            max_requests=100,
+            max_wait=0.01,
+            poll_interval=0.01,
+        )
+        calls = [call(batcher, model, {"id": n}) for n in range(3) for model in ("flash", "pro")]
+
+        return batcher, await asyncio.gather(*calls)
+
+    batcher, responses = asyncio.run(run())
+
+    assert [response.text for response in responses] == [
+        "flash:0", "pro:0", "flash:1", "pro:1", "flash:2", "pro:2",
+    ]
+    assert batcher.batches == 2
+    assert sorted(batch_models(tmp_path)) == [["flash"], ["pro"]]
+
+
+def test_failed_request_fails_only_its_own_call(tmp_path):
+    async def run():
+        batcher = Batcher(
+            FileBatchBackend(str(tmp_path), respond=respond, delay=0),
+            max_requests=100,
+            max_wait=0.01,
+            poll_interval=0.01,
+        )
+        requests = [{"id": 0}, {"id": 1, "fail": True}, {"id": 2}]
+
+        return await asyncio.gather(
+            *(call(batcher, "flash", request) for request in requests), return_exceptions=True
+        )
+
+    first, failed, last = asyncio.run(run())
+
+    assert (first.text, last.text) == ("flash:0", "flash:2")
+    assert isinstance(failed, BatchError)
+    assert "cannot answer 1" in str(failed)
+
+
+def test_max_requests_flushes_before_max_wait(tmp_path):
+    async def run():
+        batcher = Batcher(
+            FileBatchBackend(str(tmp_path), respond=respond, delay=0),
+            max_requests=2,
+            max_wait=60,
+            poll_interval=0.01,
+        )
+        responses = await asyncio.wait_for(
+            asyncio.gather(*(call(batcher, "flash", {"id": n}) for n in range(4))), timeout=5
+        )
+
+        return batcher, responses
+
+    batcher, responses = asyncio.run(run())
+
+    assert [response.text for response in responses] == [f"flash:{n}" for n in range(4)]
+    assert batcher.batches == 2
+
+
+def test_batch_backend_is_abstract():
+    with pytest.raises(TypeError):
+        BatchBackend()
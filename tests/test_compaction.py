@@ -0,0 +1,91 @@
+import pytest
+
+from compaction import (
+    apply_image_annotations,
+    boilerplate,
+    compact_lines,
+    compact_pages,
+    join_pages,
+)
+
+
+class Image:
+    def __init__(self, id, image_annotation):
+        self.id = id
+        self.image_annotation = image_annotation
+
+
+def test_apply_image_annotations():
+    markdown = "Logo ![img-0.jpeg](img-0.jpeg)\n![img-1.jpeg](img-1.jpeg)"
+    images = [Image("img-0.jpeg", "City of Toronto logo"), Image("img-1.jpeg", None)]
+
+    assert apply_image_annotations(markdown, images) == (
+        "Logo City of Toronto logo\n![img-1.jpeg](img-1.jpeg)"
+    )
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        # Image links left without an annotation
+        ("Bill ![img-1.jpeg](img-1.jpeg) here", ["Bill  here"]),
+        # Table separator rows and cell padding
+        (
+            "| Date | Amount |\n| :--- | ---: |\n|  Jan 1  |  $5.00  |",
+            ["|Date|Amount|", "|Jan 1|$5.00|"],
+        ),
+        # Runs of spaces keep the text layer columns apart
+        ("Total        $120.00", ["Total  $120.00"]),
+        # Indentation, and runs of blank lines collapsed to one
+        ("   a\n\n\n\n   b\n\n", ["a", "", "b"]),
+        ("\n\n", []),
+    ],
+)
+def test_compact_lines(text, expected):
+    assert compact_lines(text) == expected
+
+
+def test_boilerplate_needs_enough_pages():
+    pages = {0: ["City of Toronto", "a"], 1: ["City of Toronto", "b"]}
+
+    assert boilerplate(pages) == set()
+
+
+def test_boilerplate_is_repeated_header_and_footer_without_signals():
+    pages = {
+        page_no: [
+            "City of Toronto",
+            "Utility Billing",
+            f"line {page_no}",
+            "middle",
+            "middle",
+            "middle",
+            f"line {page_no + 10}",
+            "Due Date: 15/09/2022",
+            "Call 311",
+        ]
+        for page_no in range(4)
+    }
+
+    # "middle" is repeated but never among the first or last lines, the due
+    # date is repeated but carries a date
+    assert boilerplate(pages) == {"City of Toronto", "Utility Billing", "Call 311"}
+
+
+def test_compact_pages_keeps_the_first_copy_of_boilerplate():
+    pages = {
+        page_no: f"City of Toronto\n\nPage content {page_no}\n\nCall   311"
+        for page_no in (2, 0, 1)
+    }
+
+    assert compact_pages(pages) == {
+        0: "City of Toronto\n\nPage content 0\n\nCall  311",
+        1: "\nPage content 1\n",
+        2: "\nPage content 2\n",
+    }
+
+
+def test_join_pages():
+    assert join_pages({0: "a", 1: "b", 2: "c"}, [2, 0]) == (
+        "\n\nPAGE NUMBER :2\nc\n\nPAGE NUMBER :0\na"
+    )
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from governor import FakeProvider, ProviderGovernor, RateLimited
+
+
+class RecordingGovernor(ProviderGovernor):
+    """Governor with fixed backoff delays, recorded as they are taken"""
+
+    def __init__(self, delay: float = 0.01, **kwargs):
+        super().__init__({}, default_requests_per_minute=600_000, **kwargs)
+        self.delay = delay
+        self.delays = []
+
+    def backoff(self, attempt: int) -> float:
+        self.delays.append(self.delay)
+        return self.delay
+
+
+def test_rate_limited_call_is_retried_with_backoff():
+    async def run():
+        governor = RecordingGovernor(max_retries=3)
+        provider = FakeProvider(latency=0, result="ok")
+
+        async def first_call_rate_limited():
+            provider.error_rate = 1.0 if provider.calls == 0 else 0.0
+            return await provider()
+
+        result = await governor.call("model", first_call_rate_limited)
+
+        return governor, provider, result
+
+    governor, provider, result = asyncio.run(run())
+
+    assert result == "ok"
+    assert provider.calls == 2
+    assert provider.errors == 1
+    assert governor.delays == [0.01]
+    assert governor.stats()["model"]["retries"] == 1
+    assert governor.stats()["model"]["failures"] == 0
+
+
+def test_retries_stop_after_max_retries():
+    async def run():
+        governor = RecordingGovernor(max_retries=2)
+        provider = FakeProvider(latency=0, error_rate=1.0)
+
+        with pytest.raises(RateLimited):
+            await governor.call("model", provider)
+
+        return governor, provider
+
+    governor, provider = asyncio.run(run())
+
+    stats = governor.stats()["model"]
+
+    assert provider.calls == 3
+    assert (stats["calls"], stats["retries"], stats["failures"]) == (3, 2, 1)
+
+
+def test_in_flight_cap_is_never_exceeded():
+    async def run():
+        governor = RecordingGovernor(max_in_flight=3)
+        provider = FakeProvider(latency=0.01, jitter=0.005, seed=1)
+
+        await asyncio.gather(*(governor.call("model", provider) for _ in range(30)))
+
+        return provider
+
+    provider = asyncio.run(run())
+
+    assert provider.calls == 30
+    assert provider.max_in_flight == 3
+
+
+@pytest.mark.parametrize(
+    "latency, delay, error",
+    [
+        # The next retry would start after the deadline
+        (0, 0.5, RateLimited),
+        # The call itself outlives the deadline
+        (0.5, 0.01, asyncio.TimeoutError),
+    ],
+)
+def test_deadline_gives_up(latency, delay, error):
+    async def run():
+        governor = RecordingGovernor(delay=delay, max_retries=10)
+        provider = FakeProvider(latency=latency, error_rate=1.0)
+
+        with pytest.raises(error):
+            await governor.call("model", provider, deadline=0.1)
+
+        return governor, provider
+
+    governor, provider = asyncio.run(run())
+
+    assert provider.calls == 1
+    assert governor.stats()["model"]["failures"] == 1
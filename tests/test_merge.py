@@ -0,0 +1,133 @@
+import pytest
+
+from api_entites import BillData, DateInfo
+from merge import merge_bills
+
+
+def make_bill(
+    start: str,
+    end: str,
+    bill_no: str = "123",
+    file_name: str = "a.pdf",
+    amount: float = 100.0,
+    problems=(),
+) -> BillData:
+    def date_info(value: str) -> DateInfo:
+        year, month, day = map(int, value.split("-"))
+        return DateInfo(day=day, month=month, year=year)
+
+    return BillData(
+        file_name=file_name,
+        bill_no=bill_no,
+        start_date=date_info(start),
+        end_date=date_info(end),
+        usage=10.0,
+        water=amount,
+        sewage=None,
+        bill_amount=amount,
+        problems=list(problems),
+    )
+
+
+def as_dates(issue) -> tuple:
+    return (
+        issue.kind,
+        f"{issue.start.year}-{issue.start.month:02}-{issue.start.day:02}",
+        f"{issue.end.year}-{issue.end.month:02}-{issue.end.day:02}",
+        issue.days,
+    )
+
+
+def test_no_bills():
+    bills, summary = merge_bills([])
+
+    assert bills == []
+    assert (summary.bills, summary.duplicates, summary.issues) == (0, 0, [])
+
+
+def test_duplicates_keep_the_copy_with_fewest_problems():
+    flawed = make_bill("2022-01-01", "2022-01-31", file_name="a.pdf", problems=["x"])
+    clean = make_bill("2022-01-01", "2022-01-31", file_name="b.pdf")
+
+    bills, summary = merge_bills([flawed, clean])
+
+    assert bills == [clean]
+    assert (summary.bills, summary.duplicates) == (1, 1)
+
+
+def test_bills_are_sorted_by_period_invalid_dates_last():
+    invalid = make_bill("2022-02-30", "2022-03-31")
+    march = make_bill("2022-03-01", "2022-03-31", bill_no="9")
+    january = make_bill("2022-01-01", "2022-01-31", bill_no="9")
+
+    bills, summary = merge_bills([invalid, march, january])
+
+    assert bills == [january, march, invalid]
+    assert summary.start == DateInfo(day=1, month=1, year=2022)
+    assert summary.end == DateInfo(day=31, month=3, year=2022)
+
+
+@pytest.mark.parametrize(
+    "periods, expected",
+    [
+        # Consecutive readings share a date, or start the day after
+        ([("2022-01-01", "2022-01-31"), ("2022-01-31", "2022-02-28")], []),
+        ([("2022-01-01", "2022-01-31"), ("2022-02-01", "2022-02-28")], []),
+        (
+            [("2022-01-01", "2022-01-31"), ("2022-03-01", "2022-03-31")],
+            [("gap", "2022-02-01", "2022-02-28", 28)],
+        ),
+        (
+            [("2022-01-01", "2022-01-31"), ("2022-01-16", "2022-02-15")],
+            [("overlap", "2022-01-17", "2022-01-31", 15)],
+        ),
+        (
+            [
+                ("2022-01-01", "2022-01-31"),
+                ("2022-03-01", "2022-03-31"),
+                ("2022-03-20", "2022-04-30"),
+            ],
+            [
+                ("gap", "2022-02-01", "2022-02-28", 28),
+                ("overlap", "2022-03-21", "2022-03-31", 11),
+            ],
+        ),
+    ],
+)
+def test_period_issues(periods, expected):
+    bills = [make_bill(start, end) for start, end in reversed(periods)]
+
+    _, summary = merge_bills(bills)
+
+    assert [as_dates(issue) for issue in summary.issues] == expected
+
+
+def test_bill_numbers_are_compared_separately():
+    bills = [
+        make_bill("2022-01-01", "2022-01-31", bill_no="1"),
+        make_bill("2022-03-01", "2022-03-31", bill_no="2"),
+    ]
+
+    _, summary = merge_bills(bills)
+
+    assert summary.issues == []
+
+
+def test_totals_by_month_and_year_of_the_current_reading():
+    bills = [
+        make_bill("2021-12-01", "2021-12-31", amount=10.0),
+        make_bill("2022-01-01", "2022-01-15", amount=20.0),
+        make_bill("2022-01-15", "2022-01-31", bill_no="2", amount=30.5),
+    ]
+
+    _, summary = merge_bills(bills)
+
+    assert [(total.period, total.bills, total.bill_amount) for total in summary.monthly] == [
+        ("2021-12", 1, 10.0),
+        ("2022-01", 2, 50.5),
+    ]
+    assert [(total.period, total.bills, total.bill_amount) for total in summary.yearly] == [
+        ("2021", 1, 10.0),
+        ("2022", 2, 50.5),
+    ]
+    assert summary.monthly[1].sewage == 0
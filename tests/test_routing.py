@@ -0,0 +1,56 @@
+import pytest
+
+import routing
+import workflow
+
+EASY = {"tokens": 1000, "date_pairs": 1, "table_density": 0.1}
+
+
+@pytest.mark.parametrize(
+    "features, model, expected",
+    [
+        (EASY, "gemini-2.5-flash", (routing.LITE_MODEL, 0, "easy")),
+        (EASY, routing.LITE_MODEL, (routing.LITE_MODEL, 0, "easy")),
+        (
+            {**EASY, "tokens": routing.EASY_MAX_TOKENS + 1},
+            "gemini-2.5-flash",
+            ("gemini-2.5-flash", routing.THINKING_BUDGET, "tokens"),
+        ),
+        (
+            {**EASY, "date_pairs": 50, "table_density": 0.9},
+            "gemini-2.5-pro",
+            ("gemini-2.5-pro", routing.THINKING_BUDGET, "date_pairs,table_density"),
+        ),
+    ],
+)
+def test_route_only_goes_down_for_easy_content(features, model, expected):
+    route = routing.route(features, model)
+
+    assert (route.model, route.thinking_budget, route.reason) == expected
+
+
+def test_content_features():
+    content = "Reading 01/02/2022 to 01/03/2022\n|a|b|\n|c|d|\nTotal"
+
+    assert routing.content_features(content) == {
+        "tokens": routing.estimate_tokens(content),
+        "date_pairs": 1,
+        "table_density": 0.5,
+    }
+
+
+@pytest.mark.parametrize(
+    "routing_on, pinned, expected",
+    [
+        (True, set(), (routing.LITE_MODEL, "easy")),
+        (True, {"COMBINED_MODEL"}, ("gemini-2.5-pro", "pinned")),
+        (False, set(), ("gemini-2.5-pro", "fixed")),
+    ],
+)
+def test_extraction_route_keeps_pinned_models(monkeypatch, routing_on, pinned, expected):
+    monkeypatch.setattr(workflow, "ROUTING", routing_on)
+    monkeypatch.setattr(workflow, "PINNED_MODELS", pinned)
+
+    route = workflow.extraction_route("short bill", "gemini-2.5-pro", "COMBINED_MODEL")
+
+    assert (route.model, route.reason) == expected
@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+from pdf_source import PdfSource
+from singleflight import SingleFlight
+
+
+async def settle():
+    """Let the tasks started so far run up to their next wait"""
+
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_concurrent_calls_run_once():
+    flights = SingleFlight()
+    runs = []
+
+    async def call():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", call) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["result"] * 3
+    assert len(runs) == 1
+    assert (flights.calls, flights.coalesced, flights.in_flight()) == (1, 2, 0)
+
+
+def test_key_is_forgotten_after_success_and_failure():
+    flights = SingleFlight()
+
+    async def succeed():
+        return "ok"
+
+    async def fail():
+        raise ValueError("failed")
+
+    async def run():
+        assert await flights.do("key", succeed) == "ok"
+        assert flights.in_flight() == 0
+
+        with pytest.raises(ValueError):
+            await flights.do("key", fail)
+        assert flights.in_flight() == 0
+
+        # Not coalesced with, nor answered by, the calls that completed
+        assert await flights.do("key", succeed) == "ok"
+
+    asyncio.run(run())
+
+    assert (flights.calls, flights.coalesced) == (3, 0)
+
+
+def test_exception_reaches_every_waiter():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    async def run():
+        return await asyncio.gather(
+            *(flights.do("key", fail) for _ in range(3)), return_exceptions=True
+        )
+
+    errors = asyncio.run(run())
+
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flights.coalesced == 2
+
+
+def test_cancelled_waiter_does_not_cancel_the_others():
+    flights = SingleFlight()
+    release = None
+
+    async def call():
+        await release.wait()
+        return "result"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.create_task(flights.do("key", call))
+        await settle()
+        second = asyncio.create_task(flights.do("key", call))
+        await settle()
+
+        first.cancel()
+        await settle()
+        release.set()
+
+        return first, await second
+
+    first, result = asyncio.run(run())
+
+    assert first.cancelled()
+    assert result == "result"
+
+
+def test_shared_document_outlives_the_cancelled_first_caller(tmp_path):
+    spooled = tmp_path / "upload.pdf"
+    spooled.write_bytes(b"%PDF-1.4 document")
+    flights = SingleFlight()
+    release = None
+
+    async def read(pdf: PdfSource):
+        try:
+            await release.wait()
+            return await asyncio.to_thread(pdf.read)
+        finally:
+            pdf.close()
+
+    async def caller(pdf: PdfSource):
+        # As aprocess_bill_pdf, and its callers closing their upload
+        try:
+            return await flights.do("key", lambda: read(pdf.share()))
+        finally:
+            pdf.close()
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.create_task(caller(PdfSource(path=str(spooled), owned=True)))
+        await settle()
+        second = asyncio.create_task(caller(PdfSource(path=str(spooled), owned=True)))
+        await settle()
+
+        first.cancel()
+        await settle()
+        release.set()
+
+        return await second
+
+    assert asyncio.run(run()) == b"%PDF-1.4 document"
+    # The shared link is deleted by the run, the uploads by their callers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_events_reach_every_caller_including_late_ones():
+    flights = SingleFlight()
+    step = None
+    early, late, gone = [], [], []
+
+    async def call():
+        flights.notify("key", "first")
+        await step.wait()
+        flights.notify("key", "second")
+        return "result"
+
+    async def run():
+        nonlocal step
+        step = asyncio.Event()
+        tasks = [asyncio.create_task(flights.do("key", call, early.append))]
+        await settle()
+        cancelled = asyncio.create_task(flights.do("key", call, gone.append))
+        tasks.append(asyncio.create_task(flights.do("key", call, late.append)))
+        await settle()
+
+        cancelled.cancel()
+        await settle()
+        step.set()
+
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == ["result"] * 2
+    assert early == late == ["first", "second"]
+    # A caller that went away stops getting events
+    assert gone == ["first"]
+    # Events of a completed call are not kept
+    flights.notify("key", "after")
+    assert early == ["first", "second"]
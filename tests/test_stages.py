@@ -0,0 +1,26 @@
+import asyncio
+
+from governor import FakeProvider, ProviderGovernor
+from stages import Stage
+
+
+async def contend(stage: Stage, governor: ProviderGovernor, provider: FakeProvider):
+    async def task():
+        async with stage.slot():
+            await governor.call("model", provider)
+
+    await asyncio.gather(*(task() for _ in range(5)))
+
+
+def test_slots_work_across_event_loops():
+    stage = Stage("test", 1)
+    governor = ProviderGovernor({}, max_in_flight=1)
+    provider = FakeProvider(latency=0.001)
+
+    # Each asyncio.run is a new loop, as in successive process_bill_pdf calls
+    for _ in range(2):
+        asyncio.run(contend(stage, governor, provider))
+
+    assert provider.calls == 10
+    assert provider.max_in_flight == 1
+    assert (stage.completed, stage.active, stage.queued) == (10, 0, 0)
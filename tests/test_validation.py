@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+import workflow
+from model_entities import Bill, Date
+from validation import bill_problems, document_numbers, retry_pages
+
+PAGES = {
+    0: "Water $100.00  Sewage $20.00\nTotal $120.00",
+    1: "Consumption (m3): 1,050.50",
+}
+NUMBERS = document_numbers(PAGES)
+
+
+def make_bill(**fields) -> Bill:
+    values = {
+        "page_no": 0,
+        "previous_date": Date(day=1, month=1, year=2022),
+        "current_date": Date(day=1, month=3, year=2022),
+        "consumption": 1050.5,
+        "total_bill": 100.0,
+        "sewage": 20.0,
+        "bill_no": "123",
+    }
+
+    return Bill(**{**values, **fields})
+
+
+def test_document_numbers():
+    assert NUMBERS == {100.0, 20.0, 120.0, 3.0, 1050.5}
+
+
+@pytest.mark.parametrize(
+    "fields, expected",
+    [
+        ({}, []),
+        ({"page_no": 5}, ["page 5 is not a page of the document"]),
+        ({"sewage": 30.0}, ["= 130.0 is not a total printed"]),
+        ({"total_bill": 120.0, "sewage": None}, []),
+        ({"total_bill": 90.0, "sewage": 30.0}, ["water amount 90.0 is not printed"]),
+        (
+            {"previous_date": Date(day=1, month=3, year=2022)},
+            ["previous reading date is not before"],
+        ),
+        (
+            {"previous_date": Date(day=1, month=1, year=2021)},
+            ["reading period of 424 days is too long"],
+        ),
+        ({"current_date": Date(day=30, month=2, year=2022)}, ["invalid reading date"]),
+        (
+            {
+                "previous_date": Date(day=1, month=1, year=2999),
+                "current_date": Date(day=1, month=2, year=2999),
+            },
+            ["current reading date is in the future"],
+        ),
+        ({"consumption": 0}, ["implausible consumption of 0"]),
+        ({"consumption": 60.0}, ["consumption 60.0 is not printed"]),
+    ],
+)
+def test_bill_problems(fields, expected):
+    problems = bill_problems(make_bill(**fields), PAGES, NUMBERS)
+
+    assert len(problems) == len(expected), problems
+    for problem, fragment in zip(problems, expected):
+        assert fragment in problem
+
+
+@pytest.mark.parametrize(
+    "page_no, expected",
+    [(0, [0, 1]), (1, [0, 1, 2]), (2, [1, 2]), (9, [0, 1, 2])],
+)
+def test_retry_pages(page_no, expected):
+    pages = {0: "", 1: "", 2: ""}
+
+    assert retry_pages(make_bill(page_no=page_no), pages) == expected
+
+
+@pytest.mark.parametrize(
+    "retry, problems, expected",
+    [
+        (True, [[], []], "extract_images"),
+        (True, [[], ["wrong total"]], "retry_bills"),
+        (False, [["wrong total"]], "extract_images"),
+    ],
+)
+def test_has_invalid_bills(monkeypatch, retry, problems, expected):
+    monkeypatch.setattr(workflow, "VALIDATION_RETRY", retry)
+
+    assert workflow.has_invalid_bills({"bill_problems": problems}) == expected
+
+
+@pytest.mark.parametrize(
+    "retried_fields, replaced",
+    [
+        # Fixed by the retry
+        ({"sewage": 20.0}, True),
+        # Fails as many checks as the original
+        ({"sewage": 40.0}, False),
+        # Fails more checks than the original
+        ({"sewage": 40.0, "consumption": 60.0}, False),
+    ],
+)
+def test_retry_bills_keeps_the_bill_failing_fewer_checks(
+    monkeypatch, retried_fields, replaced
+):
+    original = make_bill(sewage=30.0)
+    retried = make_bill(**retried_fields)
+
+    async def retry_bill(bill, problems, pages):
+        return retried, {"node": "retry_bill"}
+
+    monkeypatch.setattr(workflow, "retry_bill", retry_bill)
+
+    state = {
+        "bills": [make_bill(), original],
+        "bill_problems": [[], bill_problems(original, PAGES, NUMBERS)],
+        "pages": PAGES,
+        "prompt_pages": PAGES,
+        "llm_calls": [],
+    }
+    update = asyncio.run(workflow.retry_bills(state))
+
+    assert update["bills"][1] is (retried if replaced else original)
+    assert update["bills"][0] is state["bills"][0]
+    assert len(update["llm_calls"]) == 1
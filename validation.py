@@ -0,0 +1,90 @@
+import os
+import re
+from datetime import date
+from typing import List
+
+from model_entities import Bill, Date
+
+NUMBER_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+# Longest reading period of a single bill, quarterly bills included
+MAX_PERIOD_DAYS = int(os.environ.get("MAX_PERIOD_DAYS", "200"))
+
+# Largest consumption of a single bill in m3
+MAX_CONSUMPTION = float(os.environ.get("MAX_CONSUMPTION", "1000000"))
+
+
+def document_numbers(pages: dict[int, str]) -> set[float]:
+    """Every number printed in the document, rounded to cents"""
+
+    numbers = set()
+
+    for text in pages.values():
+        for match in NUMBER_PATTERN.findall(text):
+            try:
+                numbers.add(round(float(match.replace(",", "")), 2))
+            except ValueError:
+                continue
+
+    return numbers
+
+
+def to_date(value: Date) -> date:
+    return date(value.year, value.month, value.day)
+
+
+def bill_problems(bill: Bill, pages: dict[int, str], numbers: set[float]) -> List[str]:
+    """Return the checks a bill fails, empty when it looks right.
+
+    The model is asked for water and sewage such that water + sewage is the
+    total bill, so the sum has to be printed somewhere in the document, as
+    do the water amount and the consumption.
+    """
+
+    problems = []
+
+    if bill.page_no not in pages:
+        problems.append(f"page {bill.page_no} is not a page of the document")
+
+    amount = round(bill.total_bill + (bill.sewage or 0), 2)
+    if amount not in numbers:
+        problems.append(
+            f"water {bill.total_bill} + sewage {bill.sewage or 0} = {amount} "
+            "is not a total printed on the bill"
+        )
+    elif round(bill.total_bill, 2) not in numbers:
+        problems.append(f"water amount {bill.total_bill} is not printed on the bill")
+
+    try:
+        previous_date = to_date(bill.previous_date)
+        current_date = to_date(bill.current_date)
+    except ValueError as error:
+        problems.append(f"invalid reading date: {error}")
+    else:
+        period = (current_date - previous_date).days
+
+        if period <= 0:
+            problems.append("the previous reading date is not before the current one")
+        elif period > MAX_PERIOD_DAYS:
+            problems.append(f"the reading period of {period} days is too long")
+
+        if current_date > date.today():
+            problems.append("the current reading date is in the future")
+
+    if not 0 < bill.consumption <= MAX_CONSUMPTION:
+        problems.append(f"implausible consumption of {bill.consumption} m3")
+    elif round(bill.consumption, 2) not in numbers:
+        problems.append(f"consumption {bill.consumption} is not printed on the bill")
+
+    return problems
+
+
+def retry_pages(bill: Bill, pages: dict[int, str]) -> List[int]:
+    """Pages sent back to the model for a failing bill: its page and the
+    pages next to it, where the totals or readings of the bill often are"""
+
+    return [
+        page_no
+        for page_no in (bill.page_no - 1, bill.page_no, bill.page_no + 1)
+        if page_no in pages
+    ] or sorted(pages)
@@ -1,23 +1,51 @@
 from typing import Tuple
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import nullcontext
 from api_entites import BillData, DateInfo
 from model_entities import Bill, Date
-from typing import Literal, Optional, List
+from cache import PageCache, ResultCache
+from page_signals import bill_pages, estimate_tokens, select_relevant_pages
+from compaction import apply_image_annotations, compact_pages, join_pages
+import rules
+import routing
+from validation import bill_problems, document_numbers, retry_pages
+from rendering import DEFAULT_RENDER_OPTIONS, arender_pages
+from blob_store import BlobStore
+from pdf_source import PdfSource, as_pdf_source
+from governor import governor
+from singleflight import SingleFlight
+from stages import LoopLocal, stage
+from cassettes import play
+from batching import BatchRequest, active_batcher
+from metrics import (
+    CONTENT_CHARS,
+    CONTENT_TOKENS,
+    DOCUMENT_DURATION,
+    BILL_VALIDATIONS,
+    EXTRACTIONS,
+    LLM_CALL_DURATION,
+    LLM_ROUTES,
+    LLM_TOKENS,
+    NODE_DURATION,
+    OCR_CHUNKS,
+    PAGES,
+    PDF_BYTES,
+    add_to_breakdown,
+    registry,
+)
+from typing import Callable, Literal, Optional, List, Union
 from pydantic import BaseModel, Field
 from typing import Annotated
+import operator
 import base64
-from mistralai import Mistral
 import os
 from typing_extensions import TypedDict
 from dotenv import load_dotenv
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
-from google import genai
-from google.genai import types
+from providers import genai_types as types, google_client, mistral_client, mistral_models
 import json
-import fitz  # PyMuPDF - pip install PyMuPDF
-from PIL import Image
-import io
-import base64
 
 
 
@@ -30,19 +58,270 @@ class Bills(BaseModel):
 
 load_dotenv()
 
-api_key = os.environ["MISTRAL_API_KEY"]
+logger = logging.getLogger(__name__)
+
+# Upper bound on documents running through the graph at once in this process,
+# shared by every request handled by the worker. The work itself is bounded
+# per stage: at most OCR_CONCURRENCY OCR calls, LLM_CONCURRENCY Gemini calls
+# and RENDER_PROCESSES rendering tasks run at once, documents queue for each
+# stage as they reach it.
+PIPELINE_CONCURRENCY = int(os.environ.get("PIPELINE_CONCURRENCY", "32"))
+OCR_CONCURRENCY = int(os.environ.get("OCR_CONCURRENCY", "8"))
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "16"))
+
+_pipeline_slots = LoopLocal(lambda: asyncio.Semaphore(PIPELINE_CONCURRENCY))
+ocr_stage = stage("ocr", OCR_CONCURRENCY)
+llm_stage = stage("llm", LLM_CONCURRENCY)
+
+# "two_step" classifies the document and then extracts its bills with a second
+# call, "combined" asks for address, classification and bills in one call and
+# only falls back to the two step path when that answer fails validation.
+GRAPH_MODE = os.environ.get("GRAPH_MODE", "two_step")
+COMBINED_MODEL = os.environ.get("COMBINED_MODEL", "gemini-2.5-flash")
+
+# "single_call" extracts multiple bills from the whole document at once,
+# "map_reduce" extracts windows of MAP_REDUCE_WINDOW candidate bill pages in
+# parallel with MAP_REDUCE_MODEL and merges the results.
+MULTI_BILL_STRATEGY = os.environ.get("MULTI_BILL_STRATEGY", "single_call")
+MAP_REDUCE_MODEL = os.environ.get("MAP_REDUCE_MODEL", "gemini-2.5-flash-lite")
+MAP_REDUCE_WINDOW = int(os.environ.get("MAP_REDUCE_WINDOW", "2"))
+
+# Pages with embedded text are read locally with PyMuPDF instead of being
+# OCR'd, as long as they carry at least TEXT_LAYER_MIN_CHARS readable characters
+TEXT_LAYER_FAST_PATH = os.environ.get("TEXT_LAYER_FAST_PATH", "1") == "1"
+TEXT_LAYER_MIN_CHARS = int(os.environ.get("TEXT_LAYER_MIN_CHARS", "200"))
+
+# Only pages carrying bill data are sent to the classifier and extraction
+# calls, up to PROMPT_TOKEN_BUDGET estimated tokens of page content
+PAGE_FILTER = os.environ.get("PAGE_FILTER", "1") == "1"
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "16000"))
+
+# Documents with more than OCR_CHUNK_THRESHOLD pages to OCR are split into
+# chunks of OCR_CHUNK_PAGES pages, OCR'd in parallel. A failed chunk is tried
+# again up to OCR_CHUNK_RETRIES times, on top of the governor retries.
+OCR_CHUNK_THRESHOLD = int(os.environ.get("OCR_CHUNK_THRESHOLD", "16"))
+OCR_CHUNK_PAGES = int(os.environ.get("OCR_CHUNK_PAGES", "8"))
+OCR_CHUNK_RETRIES = int(os.environ.get("OCR_CHUNK_RETRIES", "1"))
+
+# Page content is compacted (compaction.compact_pages) before it is put in a
+# prompt, rules and validation keep reading the pages as extracted
+CONTENT_COMPACTION = os.environ.get("CONTENT_COMPACTION", "1") == "1"
+
+# Bills failing validation.bill_problems are extracted again, once, from their
+# own pages with VALIDATION_RETRY_MODEL
+VALIDATION_RETRY = os.environ.get("VALIDATION_RETRY", "1") == "1"
+VALIDATION_RETRY_MODEL = os.environ.get("VALIDATION_RETRY_MODEL", "gemini-2.5-flash")
+
+# Extraction calls of easy content are routed down to the lite model by
+# routing.route, from features of the content, the others keep the model of
+# their node. Bills failing validation escalate to VALIDATION_RETRY_MODEL.
+# With ROUTING=0 every node uses its model.
+ROUTING = os.environ.get("ROUTING", "1") == "1"
+
+# Models set in the environment are the operator's choice, never routed
+PINNED_MODELS = {
+    setting for setting in ("COMBINED_MODEL", "MAP_REDUCE_MODEL") if setting in os.environ
+}
+
+# Bills of known layouts (rules.LAYOUTS) are read with regexes, the LLM nodes
+# only run when a field is missing or the amounts do not add up
+RULE_EXTRACTION = os.environ.get("RULE_EXTRACTION", "1") == "1"
+
+# "inline" embeds the base64 page image in every bill, "ref" only returns the
+# URL of the page image, rendered on first request from the PDF kept in the
+# blob store, "none" skips images altogether
+ImageMode = Literal["inline", "ref", "none"]
+
+blob_store = BlobStore(
+    os.environ.get("BLOB_STORE_PATH", ".cache/blobs"),
+    max_bytes=int(os.environ.get("BLOB_STORE_MAX_BYTES", str(10 * 1024**3))),
+    ttl_seconds=float(os.environ.get("BLOB_STORE_TTL", str(30 * 24 * 3600))),
+)
+
+# Sources whose prompts, models and schemas shape an extraction result. Their
+# hash is part of every result cache key, so editing any of them invalidates
+# old entries.
+VERSIONED_MODULES = [
+    "workflow.py",
+    "model_entities.py",
+    "api_entites.py",
+    "page_signals.py",
+    "compaction.py",
+    "rules.py",
+    "routing.py",
+    "validation.py",
+    "rendering.py",
+]
+
+
+def pipeline_version() -> str:
+    if os.environ.get("PIPELINE_VERSION"):
+        return os.environ["PIPELINE_VERSION"]
+
+    digest = hashlib.sha256(
+        f"{GRAPH_MODE}:{MULTI_BILL_STRATEGY}:{PAGE_FILTER}:{PROMPT_TOKEN_BUDGET}:"
+        f"{RULE_EXTRACTION}:{VALIDATION_RETRY}:{VALIDATION_RETRY_MODEL}:"
+        f"{CONTENT_COMPACTION}:{ROUTING}:{routing.policy()}:{COMBINED_MODEL}:"
+        f"{MAP_REDUCE_MODEL}:{sorted(PINNED_MODELS)}".encode()
+    )
+    digest.update(DEFAULT_RENDER_OPTIONS.model_dump_json().encode())
+    for module in VERSIONED_MODULES:
+        with open(os.path.join(os.path.dirname(__file__), module), "rb") as source:
+            digest.update(source.read())
+
+    return digest.hexdigest()[:16]
+
+
+# Set RESULT_CACHE_PATH to an empty string to disable the result cache
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", ".cache/results.sqlite3")
+
+result_cache = (
+    ResultCache(
+        RESULT_CACHE_PATH,
+        version=pipeline_version(),
+        max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "10000")),
+        max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(2 * 1024**3))),
+        ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL", str(30 * 24 * 3600))),
+    )
+    if RESULT_CACHE_PATH
+    else None
+)
+
+
+# Per page OCR markdown, shared by every PDF containing the same page. Set
+# PAGE_CACHE_PATH to an empty string to disable it.
+PAGE_CACHE_PATH = os.environ.get("PAGE_CACHE_PATH", ".cache/pages.sqlite3")
+
+page_cache = (
+    PageCache(
+        PAGE_CACHE_PATH,
+        model="mistral-ocr-latest",
+        max_entries=int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", "200000")),
+        max_bytes=int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(2 * 1024**3))),
+        ttl_seconds=float(os.environ.get("PAGE_CACHE_TTL", str(90 * 24 * 3600))),
+    )
+    if PAGE_CACHE_PATH
+    else None
+)
+
+
+def collect_cache_metrics():
+    families = []
+
+    for name, cache in (("result", result_cache), ("page", page_cache)):
+        if not cache:
+            continue
+
+        stats = cache.stats()
+        families += [
+            (
+                f"bill_parser_{name}_cache_lookups_total",
+                f"{name.capitalize()} cache lookups, by outcome",
+                "counter",
+                [
+                    ({"outcome": "hit"}, stats["hits"]),
+                    ({"outcome": "miss"}, stats["misses"]),
+                ],
+            ),
+            (
+                f"bill_parser_{name}_cache_evictions_total",
+                f"{name.capitalize()} cache entries evicted",
+                "counter",
+                [({}, stats["evictions"])],
+            ),
+            (
+                f"bill_parser_{name}_cache_bytes",
+                f"Size of the {name} cache entries",
+                "gauge",
+                [({}, stats["bytes"])],
+            ),
+        ]
+
+    families.append(
+        (
+            "bill_parser_blob_store_evictions_total",
+            "Documents evicted from the blob store",
+            "counter",
+            [({}, blob_store.evictions)],
+        )
+    )
+
+    return families
+
 
-mistral_client = Mistral(api_key=api_key)
-google_client = genai.Client()
+registry.register_collector(collect_cache_metrics)
+
+# Identical PDFs processed at the same time, e.g. double clicked uploads, run
+# through the graph once
+flights = SingleFlight()
+
+
+def collect_flight_metrics():
+    return [
+        (
+            "bill_parser_coalesced_documents_total",
+            "Documents that waited for an identical PDF already in flight",
+            "counter",
+            [({}, flights.coalesced)],
+        ),
+        (
+            "bill_parser_documents_in_flight",
+            "Distinct PDFs being processed",
+            "gauge",
+            [({}, flights.in_flight())],
+        ),
+    ]
+
+
+registry.register_collector(collect_flight_metrics)
 
 
 class State(TypedDict):
-    pdf: bytes
+    pdf: PdfSource
     content: str
+    pages: dict[int, str]
+    # Pages as put in prompts, compacted by compact_content
+    prompt_pages: dict[int, str]
+    # Estimated tokens of the whole document, "raw" and "compacted"
+    content_tokens: dict[str, int]
+    selected_pages: List[int]
     is_multiple_bills: bool
     bills: List[Bill]
     address: Optional[str]
     page_images: dict[int, str]
+    images: ImageMode
+    prerender: "Prerender"
+    llm_calls: List[dict]
+    # "rules" when the bills were read by rule_extract, "llm" otherwise
+    extracted_by: str
+    # Checks failed by each bill, in the order of bills
+    bill_problems: List[List[str]]
+    # (node, seconds) of every node run, appended to by parallel branches
+    node_timings: Annotated[List[Tuple[str, float]], operator.add]
+
+
+class Prerender:
+    """Rendering of the likely bill pages, started as soon as the page content
+    is known and awaited by extract_images.
+
+    It runs as a task next to the graph rather than as a node of it: a
+    superstep of the graph ends when all of its nodes finish, so a render
+    node would hold back the LLM branch running in the same superstep.
+    """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, pdf: PdfSource, page_nos: List[int]):
+        if self.task is None:
+            self.task = asyncio.create_task(arender_pages(pdf, page_nos))
+
+    async def result(self) -> dict[int, str]:
+        return await self.task if self.task else {}
+
+    def cancel(self):
+        if self.task:
+            self.task.cancel()
 
 
 class Answer(BaseModel):
@@ -53,42 +332,439 @@ class Answer(BaseModel):
     )
 
 
-graph_builder = StateGraph(State)
+class Extraction(BaseModel):
+    address: str = Field(description="The address of the bill")
+    is_multiple_bills: bool = Field(
+        False,
+        description="True if multiple billing periods/due dates are detected, False if single billing period",
+    )
+    bills: List[Bill] = Field(
+        ..., description="One bill per billing period found in the document"
+    )
+
+
+async def generate_content(model: str, contents, config: "types.GenerateContentConfig"):
+    """Gemini call going through the LLM stage, the provider governor and the
+    cassettes, or through a provider batch in batch mode"""
+
+    request = {
+        "contents": contents.text,
+        "config": config.model_dump(
+            mode="json", exclude_none=True, exclude={"response_schema"}
+        ),
+        "schema": config.response_schema.__name__,
+    }
+    batcher = active_batcher.get()
+
+    # Batched calls wait for their batch without holding an LLM slot, the
+    # batcher rate limits its own submissions and polls
+    if batcher is not None:
+        return await play(
+            "gemini",
+            model,
+            request,
+            types.GenerateContentResponse,
+            lambda: batcher.generate(model, BatchRequest(contents, config, request)),
+        )
 
+    async with llm_stage.slot():
+        return await governor.call(
+            model,
+            lambda: play(
+                "gemini",
+                model,
+                request,
+                types.GenerateContentResponse,
+                lambda: google_client().aio.models.generate_content(
+                    model=model, contents=contents, config=config
+                ),
+            ),
+        )
 
-def extract_content(state: State):
-    encode_bill = base64.b64encode(state["pdf"]).decode("utf-8")
-    ocr_response = mistral_client.ocr.process(
-        model="mistral-ocr-latest",
-        document={
-            "type": "document_url",
-            "document_url": f"data:application/pdf;base64,{encode_bill}",
-        },
+
+def extraction_route(
+    content: str, model: str, setting: Optional[str] = None
+) -> routing.Route:
+    """Route of an extraction call of a node using ``model``, read from the
+    ``setting`` environment variable if any"""
+
+    if setting in PINNED_MODELS:
+        return routing.Route(model=model, reason="pinned")
+
+    if not ROUTING:
+        return routing.Route(model=model, reason="fixed")
+
+    return routing.route(routing.content_features(content), model)
+
+
+def retry_route() -> routing.Route:
+    if not ROUTING:
+        return routing.Route(model=VALIDATION_RETRY_MODEL, reason="fixed")
+
+    return routing.escalate(VALIDATION_RETRY_MODEL)
+
+
+def thinking_config(route: routing.Route) -> Optional["types.ThinkingConfig"]:
+    if route.thinking_budget is None:
+        return None
+
+    return types.ThinkingConfig(thinking_budget=route.thinking_budget)
+
+
+def llm_call_record(
+    node: str,
+    model: str,
+    response,
+    started: float,
+    route: Optional[routing.Route] = None,
+) -> dict:
+    """Latency and token usage of one Gemini call, and the route it took, kept
+    in State.llm_calls and fed to the metrics"""
+
+    usage = response.usage_metadata
+    record = {
+        "node": node,
+        "model": model,
+        "latency": time.perf_counter() - started,
+        "prompt_tokens": (usage and usage.prompt_token_count) or 0,
+        "output_tokens": ((usage and usage.candidates_token_count) or 0)
+        + ((usage and usage.thoughts_token_count) or 0),
+        "route": route.model_dump() if route else None,
+    }
+
+    LLM_CALL_DURATION.observe(record["latency"], node=node, model=model)
+
+    if route:
+        LLM_ROUTES.inc(
+            node=node,
+            model=model,
+            thinking_budget=str(route.thinking_budget),
+            reason=route.reason,
+        )
+
+    for kind in ("prompt", "output"):
+        LLM_TOKENS.observe(record[f"{kind}_tokens"], model=model, kind=kind)
+        add_to_breakdown(f"{kind}_tokens", record[f"{kind}_tokens"])
+
+    return record
+
+
+def read_text_layer(pdf: PdfSource) -> Tuple[int, dict[int, str]]:
+    """Return the page count and the embedded text of every page that has a
+    usable text layer. Scanned pages, or pages whose text is mostly undecodable
+    glyphs, are left out so they go through OCR instead.
+    """
+
+    pdf_document = pdf.open()
+    pages = {}
+
+    for page in pdf_document:
+        text = page.get_text("text", sort=True).strip()
+        readable = sum(char.isalnum() for char in text)
+
+        if (
+            readable >= TEXT_LAYER_MIN_CHARS
+            and text.count("\ufffd") <= 0.1 * len(text)
+        ):
+            pages[page.number] = text
+
+    page_count = len(pdf_document)
+    pdf_document.close()
+
+    return page_count, pages
+
+
+def page_fingerprints(pdf: PdfSource, page_nos: Optional[List[int]] = None) -> dict[int, str]:
+    """Fingerprint pages by what they draw rather than by the PDF bytes: the
+    page geometry, its content stream, the streams of its images and form
+    XObjects, and its font names. The same page copied into another PDF keeps
+    its fingerprint. All pages when ``page_nos`` is None."""
+
+    pdf_document = pdf.open()
+    fingerprints = {}
+
+    for page_no in range(len(pdf_document)) if page_nos is None else page_nos:
+        page = pdf_document[page_no]
+        digest = hashlib.sha256(f"{tuple(page.rect)}:{page.rotation}".encode())
+        digest.update(page.read_contents())
+
+        xrefs = [image[0] for image in page.get_images(full=True)]
+        xrefs += [xobject[0] for xobject in page.get_xobjects()]
+        for xref in xrefs:
+            digest.update(pdf_document.xref_stream_raw(xref) or b"")
+
+        for font in page.get_fonts(full=True):
+            digest.update(font[3].encode())
+
+        fingerprints[page_no] = digest.hexdigest()
+
+    pdf_document.close()
+
+    return fingerprints
+
+
+def select_pdf_pages(pdf: PdfSource, page_nos: List[int]) -> PdfSource:
+    """Return a copy of the PDF that only holds the given pages, in that order"""
+
+    pdf_document = pdf.open()
+    pdf_document.select(page_nos)
+    reduced = pdf_document.tobytes(garbage=3, deflate=True)
+    pdf_document.close()
+
+    return PdfSource.from_bytes(reduced)
+
+
+async def ocr_pdf(pdf: PdfSource, request):
+    """OCR call going through the OCR stage, the provider governor and the
+    cassettes. ``request`` identifies the call in the cassettes."""
+
+    async with ocr_stage.slot():
+        # The data URL is the only full copy of the document made in memory,
+        # only documents holding an OCR slot have one
+        with pdf.view() as view:
+            encode_bill = base64.b64encode(view).decode("utf-8")
+
+        return await governor.call(
+            "mistral-ocr-latest",
+            lambda: play(
+                "ocr",
+                "mistral-ocr-latest",
+                request,
+                mistral_models.OCRResponse,
+                lambda: mistral_client().ocr.process_async(
+                    model="mistral-ocr-latest",
+                    document={
+                        "type": "document_url",
+                        "document_url": f"data:application/pdf;base64,{encode_bill}",
+                    },
+                ),
+            ),
+        )
+
+
+def count_pages(pdf: PdfSource) -> int:
+    with pdf.open() as pdf_document:
+        return len(pdf_document)
+
+
+async def ocr_chunk(pdf: PdfSource, page_nos: List[int], page_count: int) -> dict[int, str]:
+    """OCR some pages of the PDF, the whole PDF when they are all its pages,
+    and return their markdown by page number"""
+
+    source = pdf
+    # A whole document is identified by its digest. Reduced copies get a new
+    # random /ID on every save, they are identified by the digest of the
+    # source and their pages instead of their own bytes.
+    request = pdf.sha256()
+
+    if len(page_nos) < page_count:
+        page_nos = sorted(page_nos)
+        source = await asyncio.to_thread(select_pdf_pages, pdf, page_nos)
+        request = {"document": pdf.sha256(), "pages": page_nos}
+
+    for attempt in range(OCR_CHUNK_RETRIES + 1):
+        try:
+            response = await ocr_pdf(source, request)
+            break
+        except Exception:
+            if attempt == OCR_CHUNK_RETRIES:
+                OCR_CHUNKS.inc(outcome="failed")
+                raise
+
+            OCR_CHUNKS.inc(outcome="retried")
+            logger.warning("OCR of pages %s failed, retrying", page_nos, exc_info=True)
+
+    OCR_CHUNKS.inc(outcome="ok")
+
+    # page.index is the index in the reduced PDF
+    return {
+        page_nos[page.index]: apply_image_annotations(page.markdown, page.images)
+        for page in response.pages
+    }
+
+
+async def ocr_pages(
+    pdf: PdfSource, page_nos: List[int], page_count: int
+) -> Tuple[dict[int, str], Optional[Exception]]:
+    """OCR the pages, in chunks OCR'd in parallel when there are more than
+    OCR_CHUNK_THRESHOLD of them.
+
+    Returns the markdown by page number of the chunks that succeeded and the
+    error of the first one that failed, if any, so the caller can keep the
+    pages that were read.
+    """
+
+    if len(page_nos) > OCR_CHUNK_THRESHOLD:
+        chunks = [
+            page_nos[start : start + OCR_CHUNK_PAGES]
+            for start in range(0, len(page_nos), OCR_CHUNK_PAGES)
+        ]
+    else:
+        chunks = [page_nos]
+
+    results = await asyncio.gather(
+        *(ocr_chunk(pdf, chunk, page_count) for chunk in chunks),
+        return_exceptions=True,
+    )
+
+    pages = {}
+    error = None
+
+    for result in results:
+        if isinstance(result, Exception):
+            error = error or result
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            pages.update(result)
+
+    return pages, error
+
+
+async def extract_content(state: State):
+    page_count, pages = 0, {}
+    ocr_page_nos = None
+    sources = {}
+
+    if TEXT_LAYER_FAST_PATH:
+        page_count, pages = await asyncio.to_thread(read_text_layer, state["pdf"])
+        sources = dict.fromkeys(pages, "text_layer")
+
+        # Only pages without a usable text layer are sent to Mistral
+        ocr_page_nos = [
+            page_no for page_no in range(page_count) if page_no not in pages
+        ]
+
+    fingerprints = {}
+
+    if page_cache and (ocr_page_nos is None or ocr_page_nos):
+        fingerprints = await asyncio.to_thread(
+            page_fingerprints, state["pdf"], ocr_page_nos
+        )
+        page_count = page_count or len(fingerprints)
+        cached = await asyncio.to_thread(page_cache.get_many, fingerprints.values())
+
+        for page_no, fingerprint in fingerprints.items():
+            if fingerprint in cached:
+                pages[page_no] = cached[fingerprint]
+                sources[page_no] = "page_cache"
+
+        # Pages repeated within the document are only OCR'd once as well
+        first_page_nos = {}
+        for page_no, fingerprint in fingerprints.items():
+            if page_no not in pages:
+                first_page_nos.setdefault(fingerprint, page_no)
+
+        ocr_page_nos = sorted(first_page_nos.values())
+
+    ocr_error = None
+
+    if ocr_page_nos is None or ocr_page_nos:
+        page_count = page_count or await asyncio.to_thread(count_pages, state["pdf"])
+
+        if ocr_page_nos is None:
+            ocr_page_nos = list(range(page_count))
+
+        ocr_markdown, ocr_error = await ocr_pages(state["pdf"], ocr_page_nos, page_count)
+
+        for page_no, markdown in ocr_markdown.items():
+            pages[page_no] = markdown
+            sources[page_no] = "ocr"
+
+        if fingerprints:
+            await asyncio.to_thread(
+                page_cache.set_many,
+                {
+                    fingerprint: pages[page_no]
+                    for fingerprint, page_no in first_page_nos.items()
+                    if page_no in pages
+                },
+            )
+
+            for page_no, fingerprint in fingerprints.items():
+                if page_no not in pages and first_page_nos[fingerprint] in pages:
+                    pages[page_no] = pages[first_page_nos[fingerprint]]
+                    sources[page_no] = "page_cache"
+
+    # Pages of the chunks that were read are cached, a new attempt at the
+    # document only OCRs the chunks that failed
+    if ocr_error is not None:
+        raise ocr_error
+
+    for source in ("text_layer", "page_cache", "ocr"):
+        page_nos = [page_no for page_no in pages if sources[page_no] == source]
+        PAGES.inc(len(page_nos), source=source)
+        CONTENT_CHARS.observe(
+            sum(len(pages[page_no]) for page_no in page_nos), source=source
+        )
+
+    # Rendering runs on the process pool while the LLM calls are in flight
+    if state["images"] == "inline":
+        state["prerender"].start(state["pdf"], bill_pages(pages))
+
+    return {"pages": pages}
+
+
+def compact_content(state: State):
+    pages = state["pages"]
+    prompt_pages = compact_pages(pages) if CONTENT_COMPACTION else pages
+
+    content_tokens = {
+        "raw": estimate_tokens(join_pages(pages, sorted(pages))),
+        "compacted": estimate_tokens(join_pages(prompt_pages, sorted(prompt_pages))),
+    }
+    for step, tokens in content_tokens.items():
+        CONTENT_TOKENS.observe(tokens, stage=step)
+        add_to_breakdown(f"content_{step}_tokens", tokens)
+
+    logger.debug(
+        "Compacted %d pages from %d to %d tokens",
+        len(pages),
+        content_tokens["raw"],
+        content_tokens["compacted"],
     )
 
-    # content = "".join(
-    #     [
-    #         f"\n\nPAGE NUMBER :{page.index}\n{page.markdown}"
-    #         for page in ocr_response.pages
-    #     ]
-    # )
+    return {"prompt_pages": prompt_pages, "content_tokens": content_tokens}
 
-    content = ""
 
-    for page in ocr_response.pages:
-        content += f"\n\nPAGE NUMBER :{page.index}\n{page.markdown}"
+def select_pages(state: State):
+    """Narrow the prompt content down to the pages that carry bill data"""
 
+    if PAGE_FILTER:
+        page_nos = select_relevant_pages(state["pages"], PROMPT_TOKEN_BUDGET)
+    else:
+        page_nos = sorted(state["pages"])
 
-        for image in page.images:
+    return {
+        "content": join_pages(state["prompt_pages"], page_nos),
+        "selected_pages": page_nos,
+    }
+
+
+def rule_extract(state: State):
+    bills, address, layout, outcome = rules.extract_bills(state["pages"])
+    EXTRACTIONS.inc(
+        path="rules" if bills else "llm", layout=layout or "unknown", outcome=outcome
+    )
+
+    if not bills:
+        return {}
+
+    return {
+        "bills": bills,
+        "address": address,
+        "is_multiple_bills": len(bills) > 1,
+        "extracted_by": "rules",
+    }
 
-            if image.id and image.image_annotation:
-                content.replace(image.id,image.image_annotation)
 
-    return {**state, "content": content}
+def is_rule_extracted(state: State) -> Literal["extract_images", "llm"]:
+    return "extract_images" if state["extracted_by"] == "rules" else "llm"
 
 
-def check_multiple_bills(state: State):
-    response = google_client.models.generate_content(
+async def check_multiple_bills(state: State):
+    started = time.perf_counter()
+    response = await generate_content(
         model="gemini-2.5-flash-lite",
         contents=types.Part.from_text(text=f"""
         The following information should be present together, only then you can extract them:
@@ -128,20 +804,35 @@ def check_multiple_bills(state: State):
     response_data = json.loads(response.text or "")
 
     return {
-        **state,
         "is_multiple_bills": bool(response_data["is_multiple_bills"]),
         "address": response_data["address"],
+        "llm_calls": state["llm_calls"]
+        + [
+            llm_call_record(
+                "check_multiple_bills", "gemini-2.5-flash-lite", response, started
+            )
+        ],
     }
 
 
-def is_multiple_bills(state: State) -> Literal["single_bill", "multiple_bills"]:
-    return "multiple_bills" if state["is_multiple_bills"] else "single_bill"
+def is_multiple_bills(
+    state: State,
+) -> Literal["single_bill", "multiple_bills", "multiple_bills_map_reduce"]:
+    if not state["is_multiple_bills"]:
+        return "single_bill"
 
+    if MULTI_BILL_STRATEGY == "map_reduce":
+        return "multiple_bills_map_reduce"
 
-def single_bill(state: State):
+    return "multiple_bills"
 
-    response = google_client.models.generate_content(
-        model="gemini-2.5-flash-lite",
+
+async def single_bill(state: State):
+    started = time.perf_counter()
+    route = extraction_route(state["content"], "gemini-2.5-flash-lite")
+
+    response = await generate_content(
+        model=route.model,
         contents=types.Part.from_text(text=state["content"]),
         config=types.GenerateContentConfig(
             system_instruction="You are an expert information extractor. Your job is to extract bill information given the provided schema",
@@ -155,19 +846,26 @@ def single_bill(state: State):
             frequency_penalty=0.0,
             response_mime_type="application/json",
             response_schema=Bill,
+            thinking_config=thinking_config(route),
         ),
     )
 
     bill_data = json.loads(response.text or "")
     bill = Bill(**bill_data)
 
-    return {**state, "bills": [bill]}
+    return {
+        "bills": [bill],
+        "llm_calls": state["llm_calls"]
+        + [llm_call_record("single_bill", route.model, response, started, route)],
+    }
 
 
-def multiple_bills(state: State):
+async def multiple_bills(state: State):
+    started = time.perf_counter()
+    route = extraction_route(state["content"], "gemini-2.5-flash")
 
-    response = google_client.models.generate_content(
-        model="gemini-2.5-flash",
+    response = await generate_content(
+        model=route.model,
         contents=types.Part.from_text(text=state["content"]),
         config=types.GenerateContentConfig(
             system_instruction="You are an expert information extractor. Your job is to extract bill information given the provided schema",
@@ -181,6 +879,7 @@ def multiple_bills(state: State):
             frequency_penalty=0.0,
             response_mime_type="application/json",
             response_schema=Bills,
+            thinking_config=thinking_config(route),
         ),
     )
 
@@ -208,84 +907,367 @@ def multiple_bills(state: State):
         )
         bills.append(bill)
 
-    return {**state, "bills": bills}
+    return {
+        "bills": bills,
+        "llm_calls": state["llm_calls"]
+        + [llm_call_record("multiple_bills", route.model, response, started, route)],
+    }
+
+
+async def extract_bill_window(page_nos: List[int], pages: dict[int, str]):
+    started = time.perf_counter()
+    content = join_pages(pages, page_nos)
+    route = extraction_route(content, MAP_REDUCE_MODEL, "MAP_REDUCE_MODEL")
+
+    response = await generate_content(
+        model=route.model,
+        contents=types.Part.from_text(text=content),
+        config=types.GenerateContentConfig(
+            system_instruction="You are an expert information extractor. Your job is to extract bill information given the provided schema. Return every bill found on these pages, or no bill if there is none",
+            temperature=0,
+            top_p=0.95,
+            top_k=20,
+            candidate_count=1,
+            seed=5,
+            stop_sequences=["STOP!"],
+            presence_penalty=0.0,
+            frequency_penalty=0.0,
+            response_mime_type="application/json",
+            response_schema=Bills,
+            thinking_config=thinking_config(route),
+        ),
+    )
+
+    bills = Bills(**json.loads(response.text or "")).bills
+    record = llm_call_record(
+        "multiple_bills_map_reduce", route.model, response, started, route
+    )
 
+    return bills, record
 
-def extract_images(state: State):
 
-    # Open PDF from bytes (not base64 string)
-    pdf_document = fitz.open(stream=state["pdf"], filetype="pdf")
+def dedupe_window_bills(bills: List[Bill]) -> List[Bill]:
+    """Drop bills extracted twice from overlapping windows, the same bill number
+    and reading period count as one bill. Bills are returned in page order."""
 
-    images = {}  # Dictionary to store page_number: image_data
-    page_nos = [bill.page_no for bill in state["bills"]]
+    merged = {}
 
-    for page_num in page_nos:
+    for bill in sorted(bills, key=lambda bill: bill.page_no):
+        key = (
+            bill.bill_no.replace(" ", "").lower(),
+            bill.previous_date.model_dump_json(),
+            bill.current_date.model_dump_json(),
+        )
+        merged.setdefault(key, bill)
 
-        if page_num < len(pdf_document):
-            page = pdf_document[page_num]
+    return list(merged.values())
 
-            # Convert page to image (PNG)
-            pix = page.get_pixmap(
-                matrix=fitz.Matrix(2, 2)
-            )  # 2x zoom for better quality
-            img_data = pix.tobytes("png")
 
-            # Convert to PIL Image for easier handling
-            pil_image = Image.open(io.BytesIO(img_data))
+async def multiple_bills_map_reduce(state: State):
+    candidate_pages = bill_pages(state["pages"])
 
-            # Store as base64 for easy transmission
-            buffered = io.BytesIO()
-            pil_image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    if not candidate_pages:
+        # Nothing looks like a bill page, let the model read the whole document
+        return await multiple_bills(state)
 
-            images[page_num] = img_base64
+    windows = [
+        candidate_pages[start : start + MAP_REDUCE_WINDOW]
+        for start in range(0, len(candidate_pages), MAP_REDUCE_WINDOW)
+    ]
 
-    pdf_document.close()
+    # Latency is bound by the slowest window instead of the document length
+    results = await asyncio.gather(
+        *(extract_bill_window(window, state["prompt_pages"]) for window in windows)
+    )
 
-    return {**state, "page_images": images}
+    bills = dedupe_window_bills(
+        [bill for window_bills, _ in results for bill in window_bills]
+    )
 
+    return {
+        "bills": bills,
+        "llm_calls": state["llm_calls"] + [record for _, record in results],
+    }
 
-graph_builder.add_node("extract_content", extract_content)
-graph_builder.add_node("check_multiple_bills", check_multiple_bills)
-graph_builder.add_node("multiple_bills", multiple_bills)
-graph_builder.add_node("single_bill", single_bill)
-graph_builder.add_node("extract_images", extract_images)
 
-graph_builder.add_edge(START, "extract_content")
-graph_builder.add_edge("extract_content", "check_multiple_bills")
+async def classify_and_extract(state: State):
+    started = time.perf_counter()
+    route = extraction_route(state["content"], COMBINED_MODEL, "COMBINED_MODEL")
 
-graph_builder.add_conditional_edges("check_multiple_bills", is_multiple_bills)
+    response = await generate_content(
+        model=route.model,
+        contents=types.Part.from_text(text=state["content"]),
+        config=types.GenerateContentConfig(
+            system_instruction="""You are an expert information extractor. Your job is to extract water bill information given the provided schema.
+                                    Return the address of the bill.
+                                    Return true if multiple billing periods are detected, false if single billing period. Key indicators of multiple bills:
+                                    - Multiple due dates
+                                    - Different billing start dates
+                                    - Different billing end dates
+                                    - Different billing months/periods
+                                    - Multiple meter reading dates
 
-graph_builder.add_edge("single_bill", "extract_images")
-graph_builder.add_edge("multiple_bills", "extract_images")
+                                    Return one bill per billing period. For each bill extract the current reading date, previous reading date, consumption, water cost, sewage cost and the page number the information was found on.
+                                    The cost of water plus sewage should be equal to the total bill.""",
+            temperature=0,
+            top_p=0.95,
+            top_k=20,
+            candidate_count=1,
+            seed=5,
+            stop_sequences=["STOP!"],
+            presence_penalty=0.0,
+            frequency_penalty=0.0,
+            response_mime_type="application/json",
+            response_schema=Extraction,
+            thinking_config=thinking_config(route),
+        ),
+    )
 
-graph_builder.add_edge("extract_images", END)
+    llm_calls = state["llm_calls"] + [
+        llm_call_record("classify_and_extract", route.model, response, started, route)
+    ]
 
-graph = graph_builder.compile()
+    try:
+        answer = Extraction(**json.loads(response.text or ""))
+    except (ValueError, TypeError):
+        # Leaves no bills behind so the two step path takes over
+        return {"bills": [], "llm_calls": llm_calls}
 
+    return {
+        "address": answer.address,
+        "is_multiple_bills": answer.is_multiple_bills,
+        "bills": answer.bills,
+        "llm_calls": llm_calls,
+    }
 
-def process_bill_pdf(pdf_bytes: bytes, filename: str) -> Tuple[str, List[BillData]]:
-    """Process a PDF bill and return the final state with extracted data and images"""
 
-    # Initial state
-    initial_state = {
-        "pdf": pdf_bytes,
-        "content": "",
-        "is_multiple_bills": False,
-        "bills": [],
-        "address": None,
-        "page_images": {},
+def is_combined_valid(
+    state: State,
+) -> Literal["validate_bills", "check_multiple_bills"]:
+    bills = state["bills"]
+
+    valid = (
+        bool(bills)
+        and bool(state["address"])
+        and (state["is_multiple_bills"] or len(bills) == 1)
+        and all(bill.page_no in state["pages"] for bill in bills)
+    )
+
+    return "validate_bills" if valid else "check_multiple_bills"
+
+
+def validate_bills(state: State):
+    numbers = document_numbers(state["pages"])
+    problems = [bill_problems(bill, state["pages"], numbers) for bill in state["bills"]]
+
+    for bill_problem in problems:
+        BILL_VALIDATIONS.inc(outcome="invalid" if bill_problem else "valid")
+
+    return {"bill_problems": problems}
+
+
+def has_invalid_bills(state: State) -> Literal["retry_bills", "extract_images"]:
+    if VALIDATION_RETRY and any(state["bill_problems"]):
+        return "retry_bills"
+
+    return "extract_images"
+
+
+async def retry_bill(bill: Bill, problems: List[str], pages: dict[int, str]):
+    started = time.perf_counter()
+    content = join_pages(pages, retry_pages(bill, pages))
+    failed_checks = "\n".join(f"- {problem}" for problem in problems)
+    route = retry_route()
+
+    response = await generate_content(
+        model=route.model,
+        contents=types.Part.from_text(text=f"""
+        A previous extraction of a bill from these pages returned:
+        {bill.model_dump_json()}
+        It failed these checks:
+        {failed_checks}
+        Read the pages again and extract that bill. The cost of water plus sewage
+        must be equal to the total bill printed on the page.
+        {content}"""),
+        config=types.GenerateContentConfig(
+            system_instruction="You are an expert information extractor. Your job is to extract bill information given the provided schema",
+            temperature=0,
+            top_p=0.95,
+            top_k=20,
+            candidate_count=1,
+            seed=5,
+            response_mime_type="application/json",
+            response_schema=Bill,
+            thinking_config=thinking_config(route),
+        ),
+    )
+
+    retried = Bill(**json.loads(response.text or ""))
+
+    return retried, llm_call_record("retry_bills", route.model, response, started, route)
+
+
+async def retry_bills(state: State):
+    """Extract the bills that failed validation again, each from its own pages
+    only. A retried bill replaces the original when it fails fewer checks."""
+
+    bills = list(state["bills"])
+    problems = list(state["bill_problems"])
+    failing = [index for index, bill_problem in enumerate(problems) if bill_problem]
+
+    results = await asyncio.gather(
+        *(retry_bill(bills[index], problems[index], state["prompt_pages"]) for index in failing),
+        return_exceptions=True,
+    )
+
+    numbers = document_numbers(state["pages"])
+    records = []
+
+    for index, result in zip(failing, results):
+        if isinstance(result, BaseException):
+            logger.warning("Retry of bill %s failed", index, exc_info=result)
+        else:
+            retried, record = result
+            records.append(record)
+            retried_problems = bill_problems(retried, state["pages"], numbers)
+
+            if len(retried_problems) < len(problems[index]):
+                bills[index] = retried
+                problems[index] = retried_problems
+
+        BILL_VALIDATIONS.inc(outcome="unrepaired" if problems[index] else "repaired")
+
+    return {
+        "bills": bills,
+        "bill_problems": problems,
+        "llm_calls": state["llm_calls"] + records,
     }
 
-    # Run the workflow
-    final_state = graph.invoke(
-        initial_state
-    )  # Transform workflow results to API format
+
+async def extract_images(state: State):
+    if state["images"] != "inline":
+        return {}
+
+    # Each page is rendered once, whatever the number of bills on it
+    images = await state["prerender"].result()
+    missing = [bill.page_no for bill in state["bills"] if bill.page_no not in images]
+    images.update(await arender_pages(state["pdf"], missing))
+
+    return {"page_images": images}
+
+
+def timed(node):
+    """Wrap a node so its wall time is appended to State.node_timings, under
+    the name of the node function"""
+
+    name = node.__name__
+
+    async def run(state: State):
+        started = time.perf_counter()
+        update = node(state)
+        if asyncio.iscoroutine(update):
+            update = await update
+
+        elapsed = time.perf_counter() - started
+        NODE_DURATION.observe(elapsed, node=name)
+        add_to_breakdown(name, elapsed)
+
+        return {**update, "node_timings": [(name, elapsed)]}
+
+    return run
+
+
+def build_graph(mode: str):
+    from langgraph.graph import StateGraph, START, END
+
+    graph_builder = StateGraph(State)
+
+    graph_builder.add_node("extract_content", timed(extract_content))
+    graph_builder.add_node("compact_content", timed(compact_content))
+    graph_builder.add_node("select_pages", timed(select_pages))
+    graph_builder.add_node("check_multiple_bills", timed(check_multiple_bills))
+    graph_builder.add_node("multiple_bills", timed(multiple_bills))
+    graph_builder.add_node("multiple_bills_map_reduce", timed(multiple_bills_map_reduce))
+    graph_builder.add_node("single_bill", timed(single_bill))
+    graph_builder.add_node("validate_bills", timed(validate_bills))
+    graph_builder.add_node("retry_bills", timed(retry_bills))
+    graph_builder.add_node("extract_images", timed(extract_images))
+
+    graph_builder.add_edge(START, "extract_content")
+    graph_builder.add_edge("extract_content", "compact_content")
+    graph_builder.add_edge("compact_content", "select_pages")
+
+    if mode == "combined":
+        graph_builder.add_node("classify_and_extract", timed(classify_and_extract))
+        graph_builder.add_conditional_edges("classify_and_extract", is_combined_valid)
+        llm_start = "classify_and_extract"
+    else:
+        llm_start = "check_multiple_bills"
+
+    if RULE_EXTRACTION:
+        graph_builder.add_node("rule_extract", timed(rule_extract))
+        graph_builder.add_edge("select_pages", "rule_extract")
+        graph_builder.add_conditional_edges(
+            "rule_extract",
+            is_rule_extracted,
+            {"extract_images": "extract_images", "llm": llm_start},
+        )
+    else:
+        graph_builder.add_edge("select_pages", llm_start)
+
+    graph_builder.add_conditional_edges("check_multiple_bills", is_multiple_bills)
+
+    graph_builder.add_edge("single_bill", "validate_bills")
+    graph_builder.add_edge("multiple_bills", "validate_bills")
+    graph_builder.add_edge("multiple_bills_map_reduce", "validate_bills")
+
+    graph_builder.add_conditional_edges("validate_bills", has_invalid_bills)
+    graph_builder.add_edge("retry_bills", "extract_images")
+
+    graph_builder.add_edge("extract_images", END)
+
+    return graph_builder.compile()
+
+
+_graphs = {}
+
+
+def get_graph(mode: Optional[str] = None):
+    """Graph of a mode, compiled on first use and shared afterwards"""
+
+    mode = mode or GRAPH_MODE
+
+    if mode not in _graphs:
+        _graphs[mode] = build_graph(mode)
+
+    return _graphs[mode]
+
+
+def warm_up():
+    """Do the start up work otherwise left to the first request: import the
+    provider SDKs and PyMuPDF, create the clients and compile the graphs"""
+
+    import fitz  # noqa: F401
+
+    types.load()
+    mistral_models.load()
+    mistral_client()
+    google_client()
+
+    for mode in ("two_step", "combined"):
+        get_graph(mode)
+
+
+def to_bill_data(final_state: State, filename: str) -> List[BillData]:
+    """Transform workflow results to API format"""
+
     bill_data_list: list[BillData] = []
 
-    for bill in final_state["bills"]:
-        # Get the page image for this bill
-        page_image = final_state["page_images"][bill.page_no]
+    problems = final_state["bill_problems"]
+
+    for index, bill in enumerate(final_state["bills"]):
+        # Get the page image for this bill, only rendered for inline images
+        page_image = final_state["page_images"].get(bill.page_no)
 
         bill_data = BillData(
             file_name=filename,
@@ -304,13 +1286,268 @@ def process_bill_pdf(pdf_bytes: bytes, filename: str) -> Tuple[str, List[BillDat
             water=bill.total_bill,
             sewage=bill.sewage,
             bill_amount=bill.total_bill + (bill.sewage or 0),
+            page_no=bill.page_no,
+            problems=problems[index] if index < len(problems) else [],
             image=page_image,
+            image_format=DEFAULT_RENDER_OPTIONS.format if page_image else None,
         )
 
         bill_data_list.append(bill_data)
 
-    # Return in API format
-    return (
-        final_state.get("address", "Address not found"),
-        bill_data_list,
+    return bill_data_list
+
+
+async def attach_images(
+    bill_data_list: List[BillData], digest: str, pdf: PdfSource, images: ImageMode
+) -> List[BillData]:
+    """Fill the image fields of the bills for the requested image mode"""
+
+    if images == "none":
+        return [
+            bill.model_copy(update={"image": None, "image_format": None})
+            for bill in bill_data_list
+        ]
+
+    if images == "ref":
+        fmt = DEFAULT_RENDER_OPTIONS.format
+        return [
+            bill.model_copy(
+                update={
+                    "image": None,
+                    "image_format": fmt,
+                    "image_url": f"/bills/{digest}/pages/{bill.page_no}.{fmt}",
+                }
+            )
+            for bill in bill_data_list
+        ]
+
+    # Inline images missing from a cached result are rendered again
+    missing = [bill.page_no for bill in bill_data_list if bill.image is None]
+    page_images = await arender_pages(pdf, missing)
+
+    return [
+        bill
+        if bill.image is not None or bill.page_no not in page_images
+        else bill.model_copy(
+            update={
+                "image": page_images[bill.page_no],
+                "image_format": DEFAULT_RENDER_OPTIONS.format,
+            }
+        )
+        for bill in bill_data_list
+    ]
+
+
+def has_page(doc_id: str, page_no: int, fmt: str) -> bool:
+    """Whether a document of the blob store has the page, without rendering it"""
+
+    if blob_store.has_page(doc_id, page_no, fmt):
+        return True
+
+    pdf = blob_store.get_pdf(doc_id)
+
+    return pdf is not None and 0 <= page_no < count_pages(pdf)
+
+
+async def aget_page_image(doc_id: str, page_no: int, fmt: str) -> Optional[bytes]:
+    """Return a page of a document in the blob store as an image, rendering it
+    on first request. None when the document or the page does not exist."""
+
+    image = await asyncio.to_thread(blob_store.get_page, doc_id, page_no, fmt)
+    if image is not None:
+        return image
+
+    pdf = await asyncio.to_thread(blob_store.get_pdf, doc_id)
+    if pdf is None:
+        return None
+
+    options = DEFAULT_RENDER_OPTIONS.model_copy(update={"format": fmt})
+    rendered = await arender_pages(pdf, [page_no], options)
+    if page_no not in rendered:
+        return None
+
+    image = base64.b64decode(rendered[page_no])
+    await asyncio.to_thread(blob_store.put_page, doc_id, page_no, fmt, image)
+
+    return image
+
+
+async def arun_graph(
+    pdf: Union[bytes, PdfSource],
+    mode: Optional[str] = None,
+    images: ImageMode = "inline",
+    on_node: Optional[Callable[[str], None]] = None,
+) -> State:
+    """Run a PDF through the graph of the given mode and return the final state.
+
+    ``on_node`` is called with the name of every node as soon as it finishes.
+    """
+
+    # Initial state
+    initial_state = {
+        "pdf": as_pdf_source(pdf),
+        "content": "",
+        "pages": {},
+        "prompt_pages": {},
+        "content_tokens": {},
+        "selected_pages": [],
+        "is_multiple_bills": False,
+        "bills": [],
+        "address": None,
+        "page_images": {},
+        "images": images,
+        "prerender": Prerender(),
+        "llm_calls": [],
+        "extracted_by": "llm",
+        "bill_problems": [],
+        "node_timings": [],
+    }
+
+    # In batch mode every Gemini call of a document waits for a batch, the
+    # combined graph reads classification and bills in a single call
+    if mode is None and active_batcher.get():
+        mode = "combined"
+
+    graph = get_graph(mode)
+    PDF_BYTES.observe(initial_state["pdf"].size)
+
+    # Run the workflow. In batch mode documents spend most of their time
+    # waiting for batches, their number is bounded by the caller instead.
+    async with nullcontext() if active_batcher.get() else _pipeline_slots.get():
+        started = time.perf_counter()
+
+        try:
+            if on_node is None:
+                final_state = await graph.ainvoke(initial_state)
+            else:
+                final_state = initial_state
+
+                async for stream_mode, chunk in graph.astream(
+                    initial_state, stream_mode=["updates", "values"]
+                ):
+                    if stream_mode == "updates":
+                        for node in chunk:
+                            on_node(node)
+                    else:
+                        final_state = chunk
+        finally:
+            # Left running when the graph failed before extract_images
+            initial_state["prerender"].cancel()
+
+        DOCUMENT_DURATION.observe(time.perf_counter() - started)
+
+        return final_state
+
+
+async def extract_bill_data(
+    pdf: PdfSource,
+    digest: str,
+    filename: str,
+    images: ImageMode,
+    on_node: Optional[Callable[[str], None]],
+) -> Tuple[str, List[BillData]]:
+    """Return the address and bills of a PDF from the result cache, or from a
+    run of the graph, then cached"""
+
+    if result_cache:
+        cached = await asyncio.to_thread(result_cache.get, digest, filename)
+
+        if cached:
+            return cached
+
+    final_state = await arun_graph(pdf, images=images, on_node=on_node)
+
+    address = final_state.get("address", "Address not found")
+    bill_data_list = to_bill_data(final_state, filename)
+
+    if result_cache:
+        # Images are not cached, every image mode shares the entry
+        await asyncio.to_thread(
+            result_cache.set,
+            digest,
+            address,
+            [
+                bill.model_copy(update={"image": None, "image_format": None})
+                for bill in bill_data_list
+            ],
+        )
+
+    return address, bill_data_list
+
+
+async def extract_shared_bill_data(
+    pdf: PdfSource,
+    digest: str,
+    filename: str,
+    images: ImageMode,
+    on_node: Optional[Callable[[str], None]],
+) -> Tuple[str, List[BillData]]:
+    """``extract_bill_data`` on a source owned by the run, closed when it ends"""
+
+    try:
+        return await extract_bill_data(pdf, digest, filename, images, on_node)
+    finally:
+        await asyncio.to_thread(pdf.close)
+
+
+async def aprocess_bill_pdf(
+    pdf: Union[bytes, PdfSource],
+    filename: str,
+    images: ImageMode = "inline",
+    on_node: Optional[Callable[[str], None]] = None,
+) -> Tuple[str, List[BillData]]:
+    """Process a PDF bill asynchronously and return the address and extracted bills.
+
+    At most ``PIPELINE_CONCURRENCY`` documents run through the graph at the
+    same time in this process, the rest wait for a free slot. Within the
+    graph, OCR, LLM and rendering work queue for their own stage pools. Documents already
+    in the result cache are answered without calling any provider, and
+    concurrent calls for the same PDF share a single run.
+
+    ``pdf`` is the document bytes, or a PdfSource to process a spooled upload
+    without loading it in memory.
+    """
+
+    pdf = as_pdf_source(pdf)
+    digest = await asyncio.to_thread(pdf.sha256)
+
+    if images == "ref":
+        await asyncio.to_thread(blob_store.put_pdf, digest, pdf)
+
+    # The shared run reads its own link to the document, a caller closing its
+    # upload, e.g. when cancelled, does not delete it from under the others.
+    # Its nodes are reported to every caller sharing it.
+    address, bill_data_list = await flights.do(
+        digest,
+        lambda: extract_shared_bill_data(
+            pdf.share(),
+            digest,
+            filename,
+            images,
+            lambda node: flights.notify(digest, node),
+        ),
+        on_node,
     )
+
+    # A coalesced call returns the bills named after the first upload
+    bill_data_list = [
+        bill
+        if bill.file_name == filename
+        else bill.model_copy(update={"file_name": filename})
+        for bill in bill_data_list
+    ]
+
+    # Return in API format
+    return address, await attach_images(bill_data_list, digest, pdf, images)
+
+
+def process_bill_pdf(
+    pdf: Union[bytes, PdfSource], filename: str, images: ImageMode = "inline"
+) -> Tuple[str, List[BillData]]:
+    """Process a PDF bill and return the final state with extracted data and images
+
+    Blocking wrapper around ``aprocess_bill_pdf`` for scripts and notebooks,
+    must not be called from a running event loop.
+    """
+
+    return asyncio.run(aprocess_bill_pdf(pdf, filename, images))